@@ -0,0 +1,91 @@
+"""本機的 OpenAI 相容假上游，用於壓力測試 chall
+
+依設定的首字延遲與 token 速率回應 /v1/chat/completions，支援串流 (SSE)。
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--port", type=int, default=30100, help="Port to listen on")
+parser.add_argument(
+    "--latency", type=float, default=0.3, help="Seconds before the first token"
+)
+parser.add_argument(
+    "--tokens-per-second", type=float, default=50.0, help="Token generation rate"
+)
+parser.add_argument(
+    "--response-tokens", type=int, default=40, help="Tokens per completion"
+)
+parser.add_argument(
+    "--error-rate", type=float, default=0.0, help="Fraction of requests answered 503"
+)
+args, unknown = parser.parse_known_args()
+
+app = FastAPI(title="Fake LLM")
+
+WORDS = ["sitcon@ubuntu:~$", "ls", "-la", "total", "drwxr-xr-x", "home", "flag", "txt"]
+
+
+def completion_tokens(count: int):
+    return [random.choice(WORDS) + " " for _ in range(count)]
+
+
+def usage(messages, completion: int):
+    prompt = sum(len(message.get("content", "")) for message in messages) // 4
+    return {
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "total_tokens": prompt + completion,
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if random.random() < args.error_rate:
+        return JSONResponse({"error": "overloaded"}, status_code=503)
+
+    count = min(args.response_tokens, int(body.get("max_tokens") or 1024))
+    tokens = completion_tokens(count)
+    interval = 1.0 / args.tokens_per_second if args.tokens_per_second > 0 else 0.0
+
+    if not body.get("stream"):
+        await asyncio.sleep(args.latency + interval * count)
+        return {
+            "id": "bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": usage(body.get("messages", []), count),
+        }
+
+    async def event_stream():
+        await asyncio.sleep(args.latency)
+        for token in tokens:
+            chunk = {"choices": [{"index": 0, "delta": {"content": token}}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(interval)
+        final = {"choices": [], "usage": usage(body.get("messages", []), count)}
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,474 @@
+"""chall 與 panel 的壓力測試
+
+啟動假上游 (fake_llm.py)、chall (mongomock 或本機 mongod) 與使用暫存 SQLite 的
+panel，模擬各隊同時對話、集中提交 flag 與輪詢排行榜，最後輸出 JSON 結果：
+    python run.py --duration 30 --output baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, "bench")
+PANEL_DIR = os.path.join(ROOT, "panel")
+
+sys.path.insert(0, ROOT)
+from common.flags import derive_flag  # noqa: E402
+
+BENCH_FLAG_SECRET = "bench-flag-secret"
+ADMIN_PASSWORD = "bench-admin"
+
+COMMANDS = [
+    "ls",
+    "ls -la",
+    "pwd",
+    "whoami",
+    "cd /",
+    "ls /",
+    "cat /etc/passwd",
+    "cat /flag_t5xg4h.txt",
+    "sudo su",
+    "help",
+    "id",
+    "uname -a",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument("--teams", type=int, default=9, help="Number of teams")
+    parser.add_argument(
+        "--chat-sessions", type=int, default=27, help="Concurrent chat sessions"
+    )
+    parser.add_argument(
+        "--stream-ratio", type=float, default=0.5, help="Fraction of streamed chats"
+    )
+    parser.add_argument(
+        "--think-time", type=float, default=1.0, help="Mean pause between commands"
+    )
+    parser.add_argument(
+        "--submit-burst", type=int, default=5, help="Submissions per team per burst"
+    )
+    parser.add_argument(
+        "--submit-interval", type=float, default=5.0, help="Seconds between bursts"
+    )
+    parser.add_argument(
+        "--correct-ratio",
+        type=float,
+        default=0.05,
+        help="Fraction of correct submissions",
+    )
+    parser.add_argument(
+        "--leaderboard-pollers", type=int, default=3, help="Admins polling leaderboard"
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=1.0, help="Leaderboard poll interval"
+    )
+    parser.add_argument(
+        "--llm-latency", type=float, default=0.3, help="Fake upstream first-token delay"
+    )
+    parser.add_argument(
+        "--llm-tps", type=float, default=50.0, help="Fake upstream tokens per second"
+    )
+    parser.add_argument(
+        "--llm-tokens", type=int, default=40, help="Fake upstream tokens per reply"
+    )
+    parser.add_argument(
+        "--llm-error-rate", type=float, default=0.0, help="Fake upstream 503 ratio"
+    )
+    parser.add_argument(
+        "--mongodb",
+        type=str,
+        default="mongomock",
+        help="MongoDB URL for chall, or 'mongomock'",
+    )
+    parser.add_argument(
+        "--skip",
+        choices=["chall", "panel"],
+        action="append",
+        default=[],
+        help="Service not to benchmark, repeatable",
+    )
+    parser.add_argument("--output", type=str, default="", help="Write JSON here")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近秩 (nearest-rank) 百分位數"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    """記錄每種操作的延遲與狀態碼"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.first_byte: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(
+        self,
+        op: str,
+        started: float,
+        status: str,
+        first_byte: Optional[float] = None,
+    ):
+        self.latencies[op].append(time.perf_counter() - started)
+        self.statuses[op][status] += 1
+        if first_byte is not None:
+            self.first_byte[op].append(first_byte - started)
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        result = {}
+        for op, latencies in sorted(self.latencies.items()):
+            statuses = dict(self.statuses[op])
+            total = sum(statuses.values())
+            errors = sum(
+                count
+                for status, count in statuses.items()
+                if not status.startswith(("2", "3")) and status != "429"
+            )
+            entry = {
+                "requests": total,
+                "throughput_rps": round(total / duration, 2),
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "rejected_429": statuses.get("429", 0),
+                "statuses": statuses,
+                "latency_ms": latency_summary(latencies),
+            }
+            if self.first_byte.get(op):
+                entry["first_byte_ms"] = latency_summary(self.first_byte[op])
+            result[op] = entry
+        return result
+
+
+def latency_summary(values: List[float]) -> Dict[str, Optional[float]]:
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "p50": ms(percentile(values, 50)),
+        "p95": ms(percentile(values, 95)),
+        "p99": ms(percentile(values, 99)),
+        "max": ms(max(values) if values else None),
+    }
+
+
+class Service:
+    """以子行程啟動的服務，輸出寫入暫存目錄的 log"""
+
+    def __init__(self, name: str, command: List[str], cwd: str, env, workdir: str):
+        self.name = name
+        self.log_path = os.path.join(workdir, f"{name}.log")
+        self.log = open(self.log_path, "w")
+        self.process = subprocess.Popen(
+            command, cwd=cwd, env=env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+
+    async def wait_ready(self, url: str, timeout: float = 30.0):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient() as client:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    break
+                try:
+                    await client.get(url)
+                    return
+                except httpx.TransportError:
+                    await asyncio.sleep(0.2)
+        self.log.flush()
+        with open(self.log_path) as f:
+            output = f.read()[-2000:]
+        raise RuntimeError(f"{self.name} 啟動失敗:\n{output}")
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.log.close()
+
+
+async def chat_worker(
+    base_url: str,
+    session_id: str,
+    rng: random.Random,
+    args,
+    recorder: Recorder,
+    deadline: float,
+):
+    """模擬一個隊伍在終端機中輸入指令並等待回應"""
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0) as client:
+        while time.monotonic() < deadline:
+            stream = rng.random() < args.stream_ratio
+            payload = {
+                "message": rng.choice(COMMANDS),
+                "session_id": session_id,
+                "stream": stream,
+            }
+            op = "chat_stream" if stream else "chat"
+            started = time.perf_counter()
+            try:
+                if stream:
+                    first_byte = None
+                    status = None
+                    async with client.stream("POST", "/chat", json=payload) as response:
+                        status = str(response.status_code)
+                        async for line in response.aiter_lines():
+                            if first_byte is None:
+                                first_byte = time.perf_counter()
+                            if line and "error" in json.loads(line):
+                                status = "stream_error"
+                    recorder.record(op, started, status, first_byte)
+                else:
+                    response = await client.post("/chat", json=payload)
+                    recorder.record(op, started, str(response.status_code))
+            except httpx.HTTPError as e:
+                recorder.record(op, started, type(e).__name__)
+
+            await asyncio.sleep(rng.expovariate(1 / args.think_time))
+
+
+async def submit_worker(
+    base_url: str,
+    team: int,
+    flags: Dict[int, str],
+    rng: random.Random,
+    args,
+    recorder: Recorder,
+    deadline: float,
+):
+    """模擬隊伍集中提交 flag，答對後前往下一關"""
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+        await client.post("/set_team", data={"team": team})
+        level = 1
+        # 各隊錯開第一次提交的時間
+        await asyncio.sleep(rng.uniform(0, args.submit_interval))
+
+        async def submit(flag: str):
+            nonlocal level
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"/submit/{level}", data={"flag": flag})
+                recorder.record("submit", started, str(response.status_code))
+                # 答對時 panel 以 303 導向下一關
+                if response.status_code == 303 and level < len(flags):
+                    level += 1
+            except httpx.HTTPError as e:
+                recorder.record("submit", started, type(e).__name__)
+
+        while time.monotonic() < deadline:
+            burst = []
+            for _ in range(args.submit_burst):
+                correct = level in flags and rng.random() < args.correct_ratio
+                flag = flags[level] if correct else f"SITCON{{wrong_{rng.random()}}}"
+                burst.append(submit(flag))
+            await asyncio.gather(*burst)
+            await asyncio.sleep(args.submit_interval)
+
+
+async def leaderboard_worker(base_url: str, args, recorder: Recorder, deadline: float):
+    """模擬管理員輪詢排行榜頁面"""
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+        await client.post("/admin/login", data={"password": ADMIN_PASSWORD})
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await client.get("/leaderboard")
+                recorder.record("leaderboard", started, str(response.status_code))
+            except httpx.HTTPError as e:
+                recorder.record("leaderboard", started, type(e).__name__)
+            await asyncio.sleep(args.poll_interval)
+
+
+def team_flags(team: int) -> Dict[int, str]:
+    """依 panel/data.json 的基礎 flag 衍生該隊的 flag (僅支援字串格式)"""
+    with open(os.path.join(PANEL_DIR, "data.json"), encoding="utf-8") as f:
+        data = json.load(f)
+    return {
+        int(level): derive_flag(BENCH_FLAG_SECRET, team, int(level), flag)
+        for level, flag in data["flags"].items()
+        if isinstance(flag, str)
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    services: List[Service] = []
+    recorder = Recorder()
+
+    base_env = dict(
+        os.environ,
+        LOG_LEVEL="WARNING",
+        LOG_FILE="",
+        DISCORD_WEBHOOK_URL="",
+        FLAG_SECRET=BENCH_FLAG_SECRET,
+    )
+
+    try:
+        llm_port = free_port()
+        chall_port = free_port()
+        panel_port = free_port()
+        tasks = []
+        deadline = None
+
+        if "chall" not in args.skip:
+            llm = Service(
+                "fake_llm",
+                [
+                    sys.executable,
+                    os.path.join(BENCH_DIR, "fake_llm.py"),
+                    f"--port={llm_port}",
+                    f"--latency={args.llm_latency}",
+                    f"--tokens-per-second={args.llm_tps}",
+                    f"--response-tokens={args.llm_tokens}",
+                    f"--error-rate={args.llm_error_rate}",
+                ],
+                BENCH_DIR,
+                base_env,
+                workdir,
+            )
+            services.append(llm)
+
+            chall_env = dict(
+                base_env,
+                API_KEY="bench",
+                API_BASE=f"http://127.0.0.1:{llm_port}/v1",
+                MONGODB=args.mongodb,
+                BENCH_MONGOMOCK="1" if args.mongodb == "mongomock" else "0",
+            )
+            chall = Service(
+                "chall",
+                [
+                    sys.executable,
+                    os.path.join(BENCH_DIR, "serve_chall.py"),
+                    f"--port={chall_port}",
+                    "--challenge=bench=prompts/basic_prompt_2.txt@1",
+                ],
+                BENCH_DIR,
+                chall_env,
+                workdir,
+            )
+            services.append(chall)
+
+        if "panel" not in args.skip:
+            panel_env = dict(
+                base_env,
+                DB_PATH=os.path.join(workdir, "panel.db"),
+                SECRET_KEY="bench-secret-key-" + "x" * 32,
+                ADMIN_PASSWORD=ADMIN_PASSWORD,
+                MAX_TEAMS=str(args.teams),
+            )
+            panel = Service(
+                "panel",
+                [
+                    sys.executable,
+                    "-m",
+                    "uvicorn",
+                    "main:app",
+                    "--host=127.0.0.1",
+                    f"--port={panel_port}",
+                    "--log-level=warning",
+                ],
+                PANEL_DIR,
+                panel_env,
+                workdir,
+            )
+            services.append(panel)
+
+        for service in services:
+            port = {"fake_llm": llm_port, "chall": chall_port, "panel": panel_port}
+            await service.wait_ready(f"http://127.0.0.1:{port[service.name]}/")
+
+        deadline = time.monotonic() + args.duration
+        if "chall" not in args.skip:
+            chall_url = f"http://127.0.0.1:{chall_port}"
+            for index in range(args.chat_sessions):
+                # session ID 即隊伍編號，同一隊可能有多個人同時使用
+                session_id = str(index % args.teams + 1)
+                worker_rng = random.Random(rng.random())
+                tasks.append(
+                    chat_worker(
+                        chall_url, session_id, worker_rng, args, recorder, deadline
+                    )
+                )
+
+        if "panel" not in args.skip:
+            panel_url = f"http://127.0.0.1:{panel_port}"
+            for team in range(1, args.teams + 1):
+                worker_rng = random.Random(rng.random())
+                tasks.append(
+                    submit_worker(
+                        panel_url,
+                        team,
+                        team_flags(team),
+                        worker_rng,
+                        args,
+                        recorder,
+                        deadline,
+                    )
+                )
+            for _ in range(args.leaderboard_pollers):
+                tasks.append(leaderboard_worker(panel_url, args, recorder, deadline))
+
+        started = time.monotonic()
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+
+        return {
+            "config": vars(args),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "elapsed_seconds": round(elapsed, 2),
+            "results": recorder.summary(elapsed),
+        }
+    finally:
+        for service in reversed(services):
+            service.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    args = parse_args()
+    result = asyncio.run(run(args))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""啟動 chall，可選擇以 mongomock 取代 MongoDB
+
+參數與 chall/main.py 相同，例如：
+    python serve_chall.py --port 30007 --challenge chall1=prompts/basic_prompt_1.txt
+設定 BENCH_MONGOMOCK=1 時不需要實際的 MongoDB。
+"""
+
+import os
+import sys
+
+import uvicorn
+
+CHALL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chall")
+
+if os.getenv("BENCH_MONGOMOCK") == "1":
+    # mongomock 匯入時會把 MONGODB 環境變數當成伺服器版本，先暫時移除
+    mongodb_url = os.environ.pop("MONGODB", None)
+    import mongomock
+    import pymongo
+
+    os.environ["MONGODB"] = mongodb_url or "mongomock://localhost"
+    mock_client = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: mock_client
+
+# chall 以相對路徑讀取 static/、templates/ 與 prompt 檔案
+os.chdir(CHALL_DIR)
+sys.path.insert(0, CHALL_DIR)
+
+import main  # noqa: E402
+
+if __name__ == "__main__":
+    uvicorn.run(main.app, host="127.0.0.1", port=main.PORT, log_level="warning")
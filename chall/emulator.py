@@ -0,0 +1,424 @@
+"""在本地回答結果固定的指令 (pwd、ls、cd、echo…)，其餘指令交給模型
+
+每個挑戰的虛擬檔案系統與指令表放在 prompt 檔案旁 (basic_prompt_1.txt 對應
+basic_prompt_1.vfs.json)。終端狀態 (使用者、目錄) 由對話歷史重建，本地回答同樣
+寫入歷史，模型回應時也會收到目前的狀態，兩邊的內容保持一致。
+"""
+
+import json
+import math
+import os
+import posixpath
+import re
+import shlex
+from typing import Callable, Dict, List, Optional, Tuple
+
+from common.metrics import Counter
+
+EMULATED_COMMANDS = Counter(
+    "chall_emulator_commands_total",
+    "Commands answered locally or forwarded to the model",
+    ["result"],
+)
+
+# 含有這些字元的指令涉及展開、管線、重新導向或多個指令，一律交給模型
+SHELL_SPECIAL = set("|&;<>$`(){}[]*?!#=\\\n")
+
+# 模型回答後不會改變使用者、目錄或檔案的指令
+READ_ONLY_COMMANDS = {
+    "cat",
+    "clear",
+    "date",
+    "df",
+    "echo",
+    "env",
+    "file",
+    "find",
+    "free",
+    "grep",
+    "groups",
+    "head",
+    "history",
+    "hostname",
+    "id",
+    "ls",
+    "lsb_release",
+    "printenv",
+    "ps",
+    "pwd",
+    "stat",
+    "tail",
+    "uname",
+    "uptime",
+    "wc",
+    "which",
+    "who",
+    "whoami",
+}
+
+# 回應開頭的提示符，例如 sitcon@ubuntu:~$ ls -la
+PROMPT_LINE = re.compile(r"^([a-z_][\w-]*)@[\w.-]+:(\S*?)[$#](?: (.*))?$")
+
+DEFAULT_MODES = {"dir": "drwxr-xr-x", "file": "-rw-r--r--", "link": "lrwxrwxrwx"}
+
+
+def emulator_path(prompt_file: str) -> str:
+    """prompt 檔案對應的虛擬檔案系統設定"""
+    return os.path.splitext(prompt_file)[0] + ".vfs.json"
+
+
+class Node:
+    """虛擬檔案系統中的檔案、目錄或符號連結"""
+
+    def __init__(self, path: str, spec: Dict, default_mtime: str):
+        self.path = path
+        self.name = posixpath.basename(path) or "/"
+        self.target: Optional[str] = spec.get("target")
+        self.kind = spec.get("type") or ("link" if self.target else "file")
+        if self.kind not in DEFAULT_MODES:
+            raise ValueError(f"未知的檔案類型 {self.kind}: {path}")
+
+        self.mode = spec.get("mode", DEFAULT_MODES[self.kind])
+        self.owner = spec.get("owner", "root")
+        self.mtime = spec.get("mtime", default_mtime)
+        # 沒有 content 的檔案 (例如 flag) 由模型決定內容
+        self.content: Optional[str] = spec.get("content")
+        # 只有 complete 的目錄會在本地列出內容，其餘目錄交給模型
+        self.complete = bool(spec.get("complete", False))
+
+        if self.kind == "dir":
+            self.size = 4096
+        elif self.kind == "link":
+            self.size = len(self.target)
+        elif self.content is not None:
+            self.size = len(self.content.encode("utf-8"))
+        else:
+            self.size = int(spec.get("size", 0))
+
+    def blocks(self) -> int:
+        """ls -l 的 total 以 1K 區塊計算"""
+        if self.kind == "link":
+            return 0
+        return math.ceil(self.size / 4096) * 4
+
+
+class ShellState:
+    """由對話歷史重建的終端狀態，user / cwd 為 None 表示無法確定"""
+
+    def __init__(self, user: Optional[str], cwd: Optional[str]):
+        self.user = user
+        self.cwd = cwd
+        # 模型執行過可能修改檔案的指令後，檔案相關的指令都交給模型
+        self.pristine = True
+
+    def forget(self):
+        self.user = None
+        self.cwd = None
+        self.pristine = False
+
+
+class Emulator:
+    """單一挑戰的虛擬檔案系統與指令表"""
+
+    def __init__(self, config: Dict):
+        self.hostname = config.get("hostname", "ubuntu")
+        self.user = config.get("user", "sitcon")
+        self.home = self.home_of(self.user)
+        # 完全相符的指令直接回傳固定輸出 (例如 whoami、uname -a)
+        self.table: Dict[str, str] = config.get("commands", {})
+
+        mtime = config.get("mtime", "Jan  1 00:00")
+        self.files: Dict[str, Node] = {"/": Node("/", {"type": "dir"}, mtime)}
+        for path, spec in config.get("files", {}).items():
+            path = posixpath.normpath("/" + path.strip("/"))
+            self.files[path] = Node(path, spec, mtime)
+
+        self.children: Dict[str, List[Node]] = {path: [] for path in self.files}
+        for path, node in self.files.items():
+            if path == "/":
+                continue
+            parent = posixpath.dirname(path)
+            if parent not in self.files or self.files[parent].kind != "dir":
+                raise ValueError(f"上層目錄未定義: {path}")
+            self.children[parent].append(node)
+        for nodes in self.children.values():
+            nodes.sort(key=lambda node: node.name.lstrip(".").lower())
+
+        self.builtins: Dict[str, Callable[[ShellState, List[str]], Optional[str]]] = {
+            "cat": self._cat,
+            "cd": self._cd,
+            "clear": self._clear,
+            "echo": self._echo,
+            "ls": self._ls,
+            "pwd": self._pwd,
+        }
+        self.filesystem = "\n".join(
+            f"{node.mode} {node.owner} {node.path}"
+            + (f" -> {node.target}" if node.target else "")
+            for node in self.files.values()
+        )
+
+    @classmethod
+    def load(cls, prompt_file: str) -> Optional["Emulator"]:
+        """讀取 prompt 檔案旁的設定，沒有設定檔時回傳 None"""
+        path = emulator_path(prompt_file)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @staticmethod
+    def home_of(user: str) -> str:
+        return "/root" if user == "root" else f"/home/{user}"
+
+    # 狀態
+
+    def replay(self, history: List[Dict[str, str]]) -> ShellState:
+        """依對話歷史重建目前的使用者與目錄"""
+        state = ShellState(self.user, self.home)
+        command = None
+        for message in history:
+            if message["role"] == "user":
+                command = message["content"].strip()
+            elif message["role"] == "assistant" and command is not None:
+                self._advance(state, command, message["content"])
+                command = None
+        return state
+
+    def _advance(self, state: ShellState, command: str, response: str):
+        lines = response.strip().strip("`").strip().splitlines()
+        # 回應第一行的提示符為執行該指令時的狀態
+        if lines:
+            self._sync(state, lines[0])
+
+        if self.execute(state, command) is None:
+            words = self._split(command)
+            if words and words[0] == "cd":
+                # 目錄由模型決定，下一個回應的提示符會再同步
+                state.cwd = None
+            elif words and words[0] == "help":
+                # help 不會修改檔案，但模型可能因此視使用者為管理員
+                state.user = None
+                state.cwd = None
+            elif not words or words[0] not in READ_ONLY_COMMANDS:
+                state.forget()
+
+        # 模型有時會在結尾印出下一個提示符
+        if len(lines) > 1:
+            match = PROMPT_LINE.match(lines[-1].strip())
+            if match and not match.group(3):
+                self._sync(state, lines[-1].strip())
+
+    def _sync(self, state: ShellState, line: str):
+        match = PROMPT_LINE.match(line.strip())
+        if not match:
+            return
+        user, directory = match.group(1), match.group(2)
+        home = self.home_of(user)
+        if directory == "~" or directory.startswith("~/"):
+            directory = home + directory[1:]
+        state.user = user
+        state.cwd = posixpath.normpath(directory) if directory.startswith("/") else None
+
+    def prompt(self, state: ShellState) -> str:
+        cwd = state.cwd
+        if cwd == self.home or cwd.startswith(self.home + "/"):
+            cwd = "~" + cwd[len(self.home) :]
+        return f"{state.user}@{self.hostname}:{cwd}$"
+
+    def describe(self, state: ShellState) -> str:
+        """交給模型的終端狀態，讓模型的回答與本地回答一致"""
+        lines = ["終端狀態 (請與以下內容保持一致)："]
+        if state.user is not None and state.cwd is not None:
+            lines.append(f"- 目前使用者 {state.user}，目錄 {state.cwd}")
+        lines.append("- 已存在的檔案與目錄：")
+        lines.append(self.filesystem)
+        return "\n".join(lines)
+
+    # 指令
+
+    def execute(self, state: ShellState, command: str) -> Optional[str]:
+        """在本地執行指令並更新狀態，需要交給模型時回傳 None"""
+        if state.user != self.user or state.cwd is None:
+            return None
+        words = self._split(command)
+        if not words:
+            return None
+
+        prompt = self.prompt(state)
+        output = self.table.get(" ".join(words))
+        if output is None:
+            handler = self.builtins.get(words[0])
+            if handler is None:
+                return None
+            output = handler(state, words[1:])
+            if output is None:
+                return None
+
+        return f"{prompt} {command}" + (f"\n{output}" if output else "")
+
+    def _split(self, command: str) -> Optional[List[str]]:
+        if any(char in SHELL_SPECIAL for char in command):
+            return None
+        try:
+            return shlex.split(command)
+        except ValueError:
+            return None
+
+    def _path(self, state: ShellState, arg: str) -> str:
+        if arg == "~" or arg.startswith("~/"):
+            arg = self.home + arg[1:]
+        path = posixpath.normpath(posixpath.join(state.cwd, arg))
+        return "/" + path.lstrip("/")
+
+    def _allowed(self, node: Node, user: str, permission: str) -> bool:
+        if user == "root":
+            return True
+        bits = node.mode[1:4] if node.owner == user else node.mode[7:10]
+        # s / t 同時代表可執行
+        return permission in bits or (permission == "x" and bits[2] in "st")
+
+    def _lookup(self, user: str, path: str) -> Tuple[Optional[str], Optional[Node]]:
+        """回傳 (狀態, 節點)，狀態為 None 時表示虛擬檔案系統無法判斷"""
+        current = self.files["/"]
+        parts = [part for part in path.split("/") if part]
+        for part in parts:
+            if current.kind == "link":
+                return None, None
+            if current.kind != "dir":
+                return "Not a directory", None
+            if not self._allowed(current, user, "x"):
+                return "Permission denied", None
+            child = self.files.get(posixpath.join(current.path, part))
+            if child is None:
+                if current.complete:
+                    return "No such file or directory", None
+                return None, None
+            current = child
+        return "ok", current
+
+    def _clear(self, state: ShellState, args: List[str]) -> Optional[str]:
+        return "" if not args else None
+
+    def _pwd(self, state: ShellState, args: List[str]) -> Optional[str]:
+        if any(arg not in ("-L", "-P") for arg in args):
+            return None
+        return state.cwd
+
+    def _echo(self, state: ShellState, args: List[str]) -> Optional[str]:
+        if args and args[0].startswith("-") and args[0] != "-n":
+            return None
+        if args and args[0] == "-n":
+            args = args[1:]
+        return " ".join(args)
+
+    def _cd(self, state: ShellState, args: List[str]) -> Optional[str]:
+        if not state.pristine or len(args) > 1:
+            return None
+        arg = args[0] if args else "~"
+        if arg.startswith("-"):
+            return None
+
+        status, node = self._lookup(state.user, self._path(state, arg))
+        if status is None or (node is not None and node.kind == "link"):
+            return None
+        if status == "ok" and node.kind != "dir":
+            status = "Not a directory"
+        if status == "ok" and not self._allowed(node, state.user, "x"):
+            status = "Permission denied"
+        if status != "ok":
+            return f"bash: cd: {arg}: {status}"
+
+        state.cwd = node.path
+        return ""
+
+    def _cat(self, state: ShellState, args: List[str]) -> Optional[str]:
+        if not state.pristine or not args or any(arg.startswith("-") for arg in args):
+            return None
+
+        outputs = []
+        for arg in args:
+            status, node = self._lookup(state.user, self._path(state, arg))
+            if status is None:
+                return None
+            if status != "ok":
+                outputs.append(f"cat: {arg}: {status}")
+            elif node.kind == "dir":
+                outputs.append(f"cat: {arg}: Is a directory")
+            elif node.kind == "link" or node.content is None:
+                # 內容由模型決定 (例如 flag)，是否能讀取也交給模型判斷
+                return None
+            elif not self._allowed(node, state.user, "r"):
+                outputs.append(f"cat: {arg}: Permission denied")
+            else:
+                outputs.append(node.content.rstrip("\n"))
+        return "\n".join(outputs)
+
+    def _ls(self, state: ShellState, args: List[str]) -> Optional[str]:
+        if not state.pristine:
+            return None
+
+        flags = set()
+        paths = []
+        for arg in args:
+            if arg.startswith("-") and len(arg) > 1:
+                flags.update(arg[1:])
+            else:
+                paths.append(arg)
+        if not flags <= set("laA1") or len(paths) > 1:
+            return None
+
+        arg = paths[0] if paths else "."
+        status, node = self._lookup(state.user, self._path(state, arg))
+        if status is None:
+            return None
+        if status != "ok":
+            return f"ls: cannot access '{arg}': {status}"
+
+        if node.kind == "link":
+            # 不加 -l 時會列出連結目標的內容
+            if "l" not in flags or arg.endswith("/"):
+                return None
+            return self._long([(node, arg)])
+        if node.kind == "file":
+            return self._long([(node, arg)]) if "l" in flags else arg
+
+        if not self._allowed(node, state.user, "r"):
+            return f"ls: cannot open directory '{arg}': Permission denied"
+        if not node.complete:
+            return None
+
+        entries = [
+            (child, child.name)
+            for child in self.children[node.path]
+            if flags & set("aA") or not child.name.startswith(".")
+        ]
+        if "a" in flags:
+            parent = self.files[posixpath.dirname(node.path)]
+            entries = [(node, "."), (parent, "..")] + entries
+
+        if "l" in flags:
+            total = sum(entry.blocks() for entry, _ in entries)
+            return "\n".join([f"total {total}", self._long(entries)]).rstrip("\n")
+        separator = "\n" if "1" in flags else "  "
+        return separator.join(name for _, name in entries)
+
+    def _long(self, entries: List[Tuple[Node, str]]) -> str:
+        """ls -l 的格式，連結數與大小欄位靠右對齊"""
+        rows = []
+        for node, name in entries:
+            links = 1
+            if node.kind == "dir":
+                links = 2 + sum(
+                    child.kind == "dir" for child in self.children.get(node.path, [])
+                )
+            suffix = f" -> {node.target}" if node.target else ""
+            rows.append((node, str(links), str(node.size), name + suffix))
+
+        link_width = max((len(links) for _, links, _, _ in rows), default=1)
+        size_width = max((len(size) for _, _, size, _ in rows), default=1)
+        return "\n".join(
+            f"{node.mode} {links:>{link_width}} {node.owner} {node.owner} "
+            f"{size:>{size_width}} {node.mtime} {name}"
+            for node, links, size, name in rows
+        )
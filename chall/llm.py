@@ -0,0 +1,222 @@
+"""OpenAI 相容 API 的非同步客戶端"""
+
+import asyncio
+import json
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from common.metrics import Counter, Histogram
+from scheduler import FairScheduler, QueueFullError
+
+# 可重試的上游狀態碼
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+UPSTREAM_SECONDS = Histogram(
+    "chall_upstream_request_seconds",
+    "Upstream chat completion time including queueing and retries",
+    ["mode", "outcome"],
+)
+UPSTREAM_RETRIES = Counter(
+    "chall_upstream_retries_total", "Upstream requests retried", ["reason"]
+)
+UPSTREAM_TOKENS = Counter(
+    "chall_upstream_tokens_total", "Tokens reported by upstream usage", ["type"]
+)
+
+
+def record_usage(usage: Optional[Dict]):
+    """累計上游回報的 token 用量"""
+    if not usage:
+        return
+    UPSTREAM_TOKENS.inc(usage.get("prompt_tokens", 0), type="prompt")
+    UPSTREAM_TOKENS.inc(usage.get("completion_tokens", 0), type="completion")
+
+
+class UpstreamError(Exception):
+    """上游 API 在重試後仍然失敗"""
+
+
+class LLMClient:
+    """共用連線池的非同步 Chat Completion 客戶端"""
+
+    def __init__(
+        self,
+        api_base: str,
+        api_key: str,
+        model: str,
+        timeout: float = 60.0,
+        max_concurrency: int = 16,
+        max_queue: int = 64,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+    ):
+        self.model = model
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.client = httpx.AsyncClient(
+            base_url=api_base,
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+            ),
+        )
+        # 限制同時送往上游的請求數量，並讓各隊伍輪流使用
+        self.scheduler = FairScheduler(max_concurrency, max_queue)
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """計算重試等待時間：優先採用 Retry-After，否則為帶隨機抖動的指數退避"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+        return random.uniform(0, delay)
+
+    @asynccontextmanager
+    async def _request(self, team: str, payload: Dict):
+        """在排程名額內送出請求，遇到 429/5xx 或連線錯誤時退避重試"""
+        attempt = 0
+        while True:
+            retry_after = None
+            async with self.scheduler.slot(team):
+                try:
+                    request = self.client.build_request(
+                        "POST", "/chat/completions", json=payload
+                    )
+                    response = await self.client.send(
+                        request, stream=payload.get("stream", False)
+                    )
+                except httpx.TransportError as e:
+                    error = UpstreamError(f"上游連線失敗: {e}")
+                    reason = "transport"
+                else:
+                    if response.status_code < 400:
+                        try:
+                            yield response
+                        finally:
+                            await response.aclose()
+                        return
+
+                    await response.aclose()
+                    error = UpstreamError(f"上游回應 HTTP {response.status_code}")
+                    if response.status_code not in RETRYABLE_STATUS:
+                        raise error
+                    retry_after = response.headers.get("Retry-After")
+                    reason = str(response.status_code)
+
+            if attempt >= self.max_retries:
+                raise error
+            UPSTREAM_RETRIES.inc(reason=reason)
+
+            # 退避期間不佔用執行名額
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        team: str = "",
+        max_tokens: int = 1024,
+        temperature: float = 0.3,
+        usage: Optional[Dict] = None,
+    ) -> str:
+        """送出對話並回傳完整回應，上游回報的 token 用量會寫入 usage"""
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        }
+
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            async with self._request(team, payload) as response:
+                await response.aread()
+
+            body = response.json()
+            record_usage(body.get("usage"))
+            if usage is not None and body.get("usage"):
+                usage.update(body["usage"])
+            choices = body.get("choices") or []
+            content = choices[0].get("message", {}).get("content") if choices else None
+            if not content:
+                raise UpstreamError("API 返回空回應")
+
+            outcome = "ok"
+            return content.strip()
+        except QueueFullError:
+            outcome = "rejected"
+            raise
+        finally:
+            UPSTREAM_SECONDS.observe(
+                time.perf_counter() - started, mode="complete", outcome=outcome
+            )
+
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        team: str = "",
+        max_tokens: int = 1024,
+        temperature: float = 0.3,
+        usage: Optional[Dict] = None,
+    ) -> AsyncIterator[str]:
+        """送出對話並逐段產生回應內容，上游回報的 token 用量會寫入 usage"""
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True,
+            # 要求在最後一個事件附上 token 用量
+            "stream_options": {"include_usage": True},
+        }
+
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            async with self._request(team, payload) as response:
+                async for line in response.aiter_lines():
+                    # SSE 格式：每個事件為 "data: {...}"，以 "data: [DONE]" 結束
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:") :].strip()
+                    if data == "[DONE]":
+                        break
+
+                    chunk = json.loads(data)
+                    record_usage(chunk.get("usage"))
+                    if usage is not None and chunk.get("usage"):
+                        usage.update(chunk["usage"])
+                    choices = chunk.get("choices") or []
+                    if not choices:
+                        continue
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+            outcome = "ok"
+        except QueueFullError:
+            outcome = "rejected"
+            raise
+        except (GeneratorExit, asyncio.CancelledError):
+            # 使用者中斷連線
+            outcome = "cancelled"
+            raise
+        finally:
+            UPSTREAM_SECONDS.observe(
+                time.perf_counter() - started, mode="stream", outcome=outcome
+            )
+
+    async def close(self):
+        """關閉 HTTP 客戶端"""
+        await self.client.aclose()
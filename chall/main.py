@@ -1,23 +1,66 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi import Depends, FastAPI, Header, Request, HTTPException, Query
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import openai
 import os
+import json
+import time
+import asyncio
+import logging
+import secrets
 
-from typing import List, Dict
+from typing import Any, List, Dict, Optional, Tuple
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime
 import argparse
+import sys
+
+# 與 panel 共用的模組放在專案根目錄的 common/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.assets import REVALIDATE, PageCache, StaticAssets
+from common.flags import render_flags
+from common.log import setup_logging
+from common.metrics import CONTENT_TYPE, MetricsMiddleware, TimedTemplates
+from common.metrics import render as render_metrics
+
+from emulator import EMULATED_COMMANDS, Emulator
+from llm import LLMClient, UpstreamError
+from mongo_writer import MongoWriter
+from prompt_cache import PromptCache
+from response_cache import ResponseCache, make_cache_key
+from scheduler import QueueFullError
+from session_store import (
+    MESSAGE_TOKEN_OVERHEAD,
+    InMemorySessionStore,
+    MongoSessionStore,
+    estimate_tokens,
+    trim_history,
+)
+from token_budget import BudgetExceededError, TokenLedger
 
 load_dotenv()
 
+# JSON 記錄經由佇列在背景執行緒輸出，不佔用 event loop
+setup_logging(
+    "chall",
+    log_file=os.getenv("LOG_FILE") or None,
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+)
+logger = logging.getLogger(__name__)
+
 app = FastAPI(title="SITCON CAMP Terminal Simulator")
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+# 靜態檔案於 startup 時預先壓縮，模板以 static_url() 取得含內容雜湊的網址
+static_assets = StaticAssets("static")
+templates = TimedTemplates(directory="templates")
+templates.env.globals["static_url"] = static_assets.url
+# 首頁只取決於 chat_url，渲染一次後重複使用
+pages = PageCache(templates)
+app.add_middleware(MetricsMiddleware)
 
 api_key = os.getenv("API_KEY")
 if not api_key:
@@ -27,11 +70,45 @@ mongodb_url = os.getenv("MONGODB")
 if not mongodb_url:
     raise ValueError("請設置 MONGODB 環境變數")
 
-openai.api_key = api_key
-openai.api_base = "https://api.juheai.top/v1"
-
-# argparse for schema and promptfile
+API_BASE = os.getenv("API_BASE", "https://api.juheai.top/v1")
+MODEL = os.getenv("MODEL", "basic/gpt-4o-mini")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+MONGO_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", "100"))
+MONGO_FLUSH_INTERVAL = float(os.getenv("MONGO_FLUSH_INTERVAL", "1.0"))
+MONGO_MAX_QUEUE = int(os.getenv("MONGO_MAX_QUEUE", "10000"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(6 * 3600)))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2048"))
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+PROMPT_CHECK_INTERVAL = float(os.getenv("PROMPT_CHECK_INTERVAL", "1.0"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "0"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "5"))
+MAX_TOKENS = int(os.getenv("MAX_TOKENS", "1024"))
+TOKEN_BUDGET = int(os.getenv("TOKEN_BUDGET", "0"))
+TOKEN_BUDGET_WINDOW = float(os.getenv("TOKEN_BUDGET_WINDOW", "0"))
+TOKEN_BUDGET_SOFT_RATIO = float(os.getenv("TOKEN_BUDGET_SOFT_RATIO", "0.8"))
+TOKEN_MIN_MAX_TOKENS = int(os.getenv("TOKEN_MIN_MAX_TOKENS", "128"))
+TOKEN_FLUSH_INTERVAL = float(os.getenv("TOKEN_FLUSH_INTERVAL", "10"))
+COMMAND_EMULATOR = os.getenv("COMMAND_EMULATOR", "1") == "1"
+# 設定後 prompt 中的 flag 會替換為各隊專屬的 flag (需與 panel 相同)
+FLAG_SECRET = os.getenv("FLAG_SECRET", "")
+# 查詢對話紀錄 API 需要的主辦方憑證，未設定時停用該 API
+HISTORY_TOKEN = os.getenv("HISTORY_TOKEN", "")
+
+# argparse for challenges, schema and promptfile
 parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--challenge",
+    action="append",
+    default=[],
+    metavar="NAME=PROMPTFILE[@LEVEL]",
+    help="Challenge to host, repeatable (NAME is also the MongoDB collection)",
+)
 parser.add_argument(
     "--schema", type=str, default="chall1", help="MongoDB collection name (schema)"
 )
@@ -41,88 +118,508 @@ parser.add_argument(
     default="prompts/basic_prompt_1.txt",
     help="Prompt file location",
 )
+parser.add_argument(
+    "--level", type=int, default=None, help="Panel level whose flag the prompt holds"
+)
 parser.add_argument(
     "--port", type=int, default=30007, help="Port to run the server on"
 )
+parser.add_argument(
+    "--workers", type=int, default=1, help="Number of uvicorn worker processes"
+)
 args, unknown = parser.parse_known_args()
 
-SCHEMA_NAME = args.schema
-PROMPT_FILE = args.promptfile
+# 未指定 --challenge 時沿用 --schema / --promptfile 的單一挑戰模式
+CHALLENGE_SPECS = args.challenge or [
+    f"{args.schema}={args.promptfile}"
+    + (f"@{args.level}" if args.level is not None else "")
+]
 PORT = args.port
+WORKERS = args.workers
 
-# MongoDB 連接
+# MongoDB 連接：connect=False 延後到第一次操作 (startup) 才連線，
+# 多 worker 時主行程與重複 import 的模組不會建立連線
 try:
-    mongo_client = MongoClient(mongodb_url, tlsAllowInvalidCertificates=True)
+    mongo_client = MongoClient(
+        mongodb_url, tlsAllowInvalidCertificates=True, connect=False
+    )
     db = mongo_client.sitcon_camp
-    chall_collection = db[SCHEMA_NAME]
-    print(f"MongoDB 連接成功，使用 collection: {SCHEMA_NAME}")
 except Exception as e:
-    print(f"MongoDB 連接失敗: {e}")
+    logger.error(f"MongoDB 連接失敗: {e}")
     raise
 
-session_histories: Dict[str, List[Dict[str, str]]] = {}
+
+# 歷史查詢只回傳顯示需要的欄位
+HISTORY_PROJECTION = {"timestamp": 1, "user_input": 1, "ai_response": 1}
+HISTORY_MAX_LIMIT = 200
+
+
+def encode_cursor(record: Dict[str, Any]) -> str:
+    """以紀錄的 timestamp 與 _id 組成分頁 cursor"""
+    return f"{record['timestamp'].isoformat()}_{record['_id']}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    timestamp, _, record_id = cursor.rpartition("_")
+    try:
+        return datetime.fromisoformat(timestamp), ObjectId(record_id)
+    except (ValueError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="無效的 cursor")
+
+
+class Challenge:
+    """單一挑戰：prompt 檔案、MongoDB collection 與 session 命名空間"""
+
+    def __init__(self, name: str, prompt_file: str, level: Optional[int] = None):
+        self.name = name
+        self.prompt_file = prompt_file
+        # prompt 中的 flag 對應 panel 的哪一關，用於衍生隊伍專屬 flag
+        self.level = level
+        self.collection = db[name]
+        # (過期時間, 統計結果)
+        self.stats_cache = (0.0, None)
+        # 進行中的統計查詢，快取過期時同時到達的請求共用同一次查詢
+        self.stats_refresh: Optional[asyncio.Task] = None
+        # prompt 旁有 .vfs.json 時在本地回答固定結果的指令
+        self.emulator = Emulator.load(prompt_file) if COMMAND_EMULATOR else None
+
+    def ensure_indexes(self):
+        """依隊伍查詢並以 (timestamp, _id) 排序分頁，排序可直接由 index 提供"""
+        self.collection.create_index(
+            [("team_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]
+        )
+
+    def session_key(self, session_id: str) -> str:
+        return f"{self.name}:{session_id}"
+
+    def record_stats(self) -> Dict[str, Any]:
+        """以單次聚合查詢統計各隊伍的記錄數量"""
+        # 先依 team_id 排序並只保留 team_id，查詢只需掃描 index 不必讀取文件
+        pipeline = [
+            {"$sort": {"team_id": 1}},
+            {"$project": {"_id": 0, "team_id": 1}},
+            {"$group": {"_id": "$team_id", "count": {"$sum": 1}}},
+            {"$sort": {"_id": 1}},
+        ]
+        team_stats = [
+            {"team_id": row["_id"], "message_count": row["count"]}
+            for row in self.collection.aggregate(pipeline)
+        ]
+        return {
+            "mongodb_total_records": sum(t["message_count"] for t in team_stats),
+            "team_statistics": team_stats,
+        }
+
+    def history(
+        self,
+        team_id: int,
+        limit: int,
+        before: Optional[Tuple[datetime, ObjectId]] = None,
+        since: Optional[Tuple[datetime, ObjectId]] = None,
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """以 (timestamp, _id) keyset 分頁查詢隊伍的對話紀錄，新的在前
+
+        before 取得較舊的一頁，since 取得比 cursor 更新的紀錄 (用於輪詢)。
+        回傳 (紀錄, 是否還有更多)。
+        """
+        query: Dict[str, Any] = {"team_id": team_id}
+        order = DESCENDING
+        if before is not None:
+            timestamp, record_id = before
+            query["$or"] = [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$lt": record_id}},
+            ]
+        elif since is not None:
+            # 由舊到新取得 cursor 之後的紀錄，超過 limit 時不會跳過中間的紀錄
+            timestamp, record_id = since
+            query["$or"] = [
+                {"timestamp": {"$gt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$gt": record_id}},
+            ]
+            order = ASCENDING
+
+        records = list(
+            self.collection.find(query, HISTORY_PROJECTION)
+            .sort([("timestamp", order), ("_id", order)])
+            .limit(limit + 1)
+        )
+        has_more = len(records) > limit
+        records = records[:limit]
+        if order == ASCENDING:
+            records.reverse()
+        return records, has_more
+
+    async def cached_record_stats(self) -> Dict[str, Any]:
+        """短時間內重複查詢時回傳快取的統計結果"""
+        expires_at, stats = self.stats_cache
+        if stats is not None and expires_at > time.monotonic():
+            return stats
+
+        if self.stats_refresh is None:
+            self.stats_refresh = asyncio.create_task(self._refresh_stats())
+        # 個別請求被取消時不影響其他等待同一查詢的請求
+        return await asyncio.shield(self.stats_refresh)
+
+    async def _refresh_stats(self) -> Dict[str, Any]:
+        try:
+            stats = await asyncio.to_thread(self.record_stats)
+            self.stats_cache = (time.monotonic() + STATS_CACHE_TTL, stats)
+            return stats
+        finally:
+            self.stats_refresh = None
+
+
+def parse_challenge(spec: str) -> Challenge:
+    """解析 NAME=PROMPTFILE[@LEVEL] 格式的挑戰設定"""
+    name, sep, prompt_file = spec.partition("=")
+    if not sep or not name or not prompt_file:
+        raise ValueError(f"挑戰設定格式錯誤 (應為 NAME=PROMPTFILE): {spec}")
+
+    level = None
+    path, at, level_text = prompt_file.rpartition("@")
+    if at and level_text.strip().isdigit():
+        prompt_file, level = path, int(level_text)
+
+    return Challenge(name.strip(), prompt_file.strip(), level)
+
+
+challenges: Dict[str, Challenge] = {}
+for spec in CHALLENGE_SPECS:
+    challenge = parse_challenge(spec)
+    challenges[challenge.name] = challenge
+    if FLAG_SECRET and challenge.level is None:
+        # panel 設定 FLAG_SECRET 後只接受隊伍專屬 flag，未指定關卡的挑戰將無法解出
+        raise ValueError(
+            f"挑戰 {challenge.name} 未指定關卡，設定 FLAG_SECRET 時必須以 "
+            "NAME=PROMPTFILE@LEVEL 或 --level 指定"
+        )
+
+# 根路徑 (/、/chat) 對應第一個挑戰，與單一挑戰模式相容
+default_challenge = next(iter(challenges.values()))
+
+# 啟動時預先載入 prompt，之後依 mtime 檢查是否需要重新載入
+prompt_cache = PromptCache(check_interval=PROMPT_CHECK_INTERVAL)
+for challenge in challenges.values():
+    prompt_cache.load(challenge.prompt_file)
+
+mongo_writer = MongoWriter(
+    db,
+    batch_size=MONGO_BATCH_SIZE,
+    flush_interval=MONGO_FLUSH_INTERVAL,
+    max_queue=MONGO_MAX_QUEUE,
+)
+
+llm_client = LLMClient(
+    API_BASE,
+    api_key,
+    MODEL,
+    timeout=LLM_TIMEOUT,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    max_queue=LLM_MAX_QUEUE,
+    max_retries=LLM_MAX_RETRIES,
+)
+
+# 回傳給使用者的錯誤訊息，不直接顯示上游的例外內容
+BUSY_MESSAGE = "系統忙碌中，請稍後再試"
+UPSTREAM_ERROR_MESSAGE = "AI 服務暫時無法使用，請稍後再試"
+BUDGET_MESSAGE = "本隊的 AI 使用額度已用完，請稍後再試"
+
+# 所有挑戰共用同一個 session store，以挑戰名稱區分命名空間
+# 多個 worker 需使用共用的 session backend，否則各 worker 的對話歷史互不相通
+if SESSION_BACKEND == "mongo":
+    session_store = MongoSessionStore(db["sessions"], ttl=SESSION_TTL)
+elif SESSION_BACKEND == "memory":
+    session_store = InMemorySessionStore(
+        max_sessions=SESSION_MAX, ttl=SESSION_TTL, max_bytes=SESSION_MAX_BYTES
+    )
+else:
+    raise ValueError(f"未知的 SESSION_BACKEND: {SESSION_BACKEND}")
+
+# 各隊伍 / 挑戰的 token 用量，定期批次寫入 token_usage collection
+token_ledger = TokenLedger(
+    db["token_usage"],
+    budget=TOKEN_BUDGET,
+    window=TOKEN_BUDGET_WINDOW,
+    soft_ratio=TOKEN_BUDGET_SOFT_RATIO,
+    min_max_tokens=TOKEN_MIN_MAX_TOKENS,
+    flush_interval=TOKEN_FLUSH_INTERVAL,
+)
+
+# 相同挑戰、prompt、歷史與指令的回應快取 (RESPONSE_CACHE_SIZE=0 時停用)
+response_cache = (
+    ResponseCache(max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+    if RESPONSE_CACHE_SIZE > 0
+    else None
+)
 
 
 class ChatMessage(BaseModel):
     message: str
     session_id: str
+    stream: bool = False
 
 
-def get_prompt_for_command() -> str:
-    # 讀取基礎 prompt
-    with open(PROMPT_FILE, encoding="utf-8") as f:
-        base_prompt = f.read()
+def get_challenge(name: str) -> Challenge:
+    """依名稱獲取挑戰"""
+    challenge = challenges.get(name)
+    if challenge is None:
+        raise HTTPException(status_code=404, detail="挑戰不存在")
+    return challenge
 
-    return base_prompt
 
+def get_prompt_for_command(challenge: Challenge, team_id: str) -> str:
+    # 從快取讀取基礎 prompt
+    prompt = prompt_cache.get(challenge.prompt_file)
+    if FLAG_SECRET and challenge.level is not None:
+        # 替換為該隊伍專屬的 flag，隊伍之間無法互相分享
+        prompt = render_flags(prompt, FLAG_SECRET, team_id, challenge.level)
+    return prompt
 
-def get_session_history(session_id: str) -> List[Dict[str, str]]:
-    """獲取指定 session 的對話歷史，如果不存在則創建新的"""
-    if session_id not in session_histories:
-        session_histories[session_id] = []
 
-    return session_histories[session_id]
+async def get_session_history(
+    challenge: Challenge, session_id: str
+) -> List[Dict[str, str]]:
+    """獲取指定 session 的對話歷史，如果不存在則回傳空列表"""
+    return await session_store.get(challenge.session_key(session_id))
 
 
-def save_to_mongodb(team_id: str, user_input: str, ai_response: str):
-    """將對話記錄保存到 MongoDB"""
+def save_to_mongodb(
+    challenge: Challenge, team_id: str, user_input: str, ai_response: str
+):
+    """將對話記錄交給背景寫入佇列"""
     try:
         document = {
             "team_id": int(team_id),
             "timestamp": datetime.utcnow(),
             "user_input": user_input,
             "ai_response": ai_response,
-            "challenge": SCHEMA_NAME,
+            "challenge": challenge.name,
         }
 
-        result = chall_collection.insert_one(document)
-        print(f"MongoDB 寫入成功，ID: {result.inserted_id}")
-        print(f"User Input: {user_input}, AI Response: {ai_response}")
+        if not mongo_writer.submit(challenge.name, document):
+            logger.warning("MongoDB 寫入佇列已滿，記錄已丟棄")
 
     except Exception as e:
-        print(f"MongoDB 寫入失敗: {e}")
+        logger.error(f"MongoDB 寫入失敗: {e}")
         # 不拋出異常，避免影響主要功能
 
 
-@app.get("/", response_class=HTMLResponse)
-async def read_root(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+# 連線、建立 index 與載入資料都在 startup 進行，每個 worker 只執行一次
+@app.on_event("startup")
+async def startup_event():
+    for challenge in challenges.values():
+        challenge.ensure_indexes()
+        logger.info(f"載入挑戰 {challenge.name}，prompt: {challenge.prompt_file}")
+        if challenge.emulator is not None:
+            logger.info(f"挑戰 {challenge.name} 啟用本地指令模擬")
+    session_store.ensure_indexes()
+    logger.info("MongoDB 連接成功")
 
+    # 從 MongoDB 載入累計用量，重新啟動後預算不會歸零
+    token_ledger.load()
+    static_assets.load()
+    mongo_writer.start()
+    token_ledger.start()
 
-@app.post("/chat")
-async def chat_with_terminal(chat_message: ChatMessage):
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await llm_client.close()
+    await mongo_writer.close()
+    await token_ledger.close()
+
+
+def index_page(request: Request, chat_url: str):
+    page = pages.get(chat_url, "index.html", {"chat_url": chat_url})
+    return page.response(request, REVALIDATE)
+
+
+@app.get("/", response_class=HTMLResponse)
+async def read_root(request: Request):
+    return index_page(request, "/chat")
+
+
+@app.get("/chall/{name}/", response_class=HTMLResponse)
+async def read_challenge_root(request: Request, name: str):
+    challenge = get_challenge(name)
+    return index_page(request, f"/chall/{challenge.name}/chat")
+
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def static_file(request: Request, path: str):
+    return static_assets.response(request, path)
+
+
+async def record_turn(
+    challenge: Challenge,
+    session_id: str,
+    chat_history: List[Dict[str, str]],
+    command: str,
+    ai_response: str,
+):
+    """儲存一輪對話到 session 歷史與 MongoDB"""
+    chat_history = chat_history + [
+        {"role": "user", "content": command},
+        {"role": "assistant", "content": ai_response},
+    ]
+
+    # 依 token 預算保留最近的對話，避免 prompt 無限制變長
+    await session_store.set(
+        challenge.session_key(session_id),
+        trim_history(chat_history, HISTORY_TOKEN_BUDGET),
+    )
+
+    # 保存到 MongoDB
+    save_to_mongodb(challenge, session_id, command, ai_response)
+
+
+def account_usage(
+    challenge: Challenge,
+    session_id: str,
+    messages: List[Dict[str, str]],
+    ai_response: str,
+    usage: Dict[str, int],
+):
+    """記錄上游用量，上游未回報 usage 時以估算值代替"""
+    prompt_tokens = usage.get("prompt_tokens") or sum(
+        estimate_tokens(message["content"]) + MESSAGE_TOKEN_OVERHEAD
+        for message in messages
+    )
+    completion_tokens = usage.get("completion_tokens") or estimate_tokens(ai_response)
+    token_ledger.record(challenge.name, session_id, prompt_tokens, completion_tokens)
+
+
+async def stream_chat(
+    challenge: Challenge,
+    session_id: str,
+    chat_history: List[Dict[str, str]],
+    command: str,
+    messages: List[Dict[str, str]],
+    cache_key: Optional[str] = None,
+    max_tokens: int = MAX_TOKENS,
+):
+    """以 NDJSON 逐段輸出回應，結束後再寫入完整記錄"""
+    chunks: List[str] = []
+    # 本請求呼叫上游時登記的 future，相同的請求會等待它的結果
+    future: Optional[asyncio.Future] = None
+    try:
+        cached, pending = (
+            response_cache.lookup(cache_key) if cache_key else (None, None)
+        )
+        if pending is not None:
+            # 與進行中的相同請求共用上游結果，完成後一次輸出
+            cached = await asyncio.shield(pending)
+        if cached is not None:
+            chunks.append(cached)
+            yield json.dumps({"delta": cached}, ensure_ascii=False) + "\n"
+        else:
+            if cache_key:
+                future = response_cache.register(cache_key)
+            usage: Dict[str, int] = {}
+            try:
+                async for delta in llm_client.stream(
+                    messages,
+                    team=session_id,
+                    max_tokens=max_tokens,
+                    temperature=0.3,
+                    usage=usage,
+                ):
+                    chunks.append(delta)
+                    yield json.dumps({"delta": delta}, ensure_ascii=False) + "\n"
+            finally:
+                # 中途失敗或使用者中斷時，已產生的內容也計入用量
+                if chunks:
+                    account_usage(
+                        challenge, session_id, messages, "".join(chunks), usage
+                    )
+
+        ai_response = "".join(chunks).strip()
+        if not ai_response:
+            raise UpstreamError("API 返回空回應")
+
+        if future is not None:
+            response_cache.resolve(cache_key, future, ai_response)
+
+        await record_turn(challenge, session_id, chat_history, command, ai_response)
+
+    except QueueFullError as busy_error:
+        if future is not None:
+            response_cache.resolve(cache_key, future, error=busy_error)
+        yield json.dumps({"error": BUSY_MESSAGE}, ensure_ascii=False) + "\n"
+        return
+    except Exception as api_error:
+        if future is not None:
+            response_cache.resolve(cache_key, future, error=api_error)
+        logger.error(
+            f"上游 API 錯誤: {api_error}",
+            extra={"challenge": challenge.name, "team": session_id},
+        )
+        yield json.dumps({"error": UPSTREAM_ERROR_MESSAGE}, ensure_ascii=False) + "\n"
+        return
+    finally:
+        if future is not None:
+            # 使用者中斷串流時，等待中的相同請求改收到錯誤 (已完成時不會改變)
+            response_cache.resolve(cache_key, future)
+
+    yield json.dumps(
+        {"done": True, "response": ai_response, "session_id": session_id},
+        ensure_ascii=False,
+    ) + "\n"
+
+
+async def emulated_stream(session_id: str, ai_response: str):
+    """本地回答的串流格式與模型回應相同"""
+    yield json.dumps({"delta": ai_response}, ensure_ascii=False) + "\n"
+    yield json.dumps(
+        {"done": True, "response": ai_response, "session_id": session_id},
+        ensure_ascii=False,
+    ) + "\n"
+
+
+async def handle_chat(challenge: Challenge, chat_message: ChatMessage):
     try:
         command = chat_message.message.strip()
         session_id = chat_message.session_id.strip()
 
         if not session_id:
             raise HTTPException(status_code=400, detail="Session ID 不能為空")
+        # session ID 即隊伍編號，用於衍生隊伍專屬 flag 與寫入記錄
+        if not (session_id.isascii() and session_id.isdigit()):
+            raise HTTPException(status_code=400, detail="Session ID 必須為隊伍編號")
+        # 統一格式 ("01" -> "1")，token 額度、排程、session 與記錄都以同一個鍵計算
+        session_id = str(int(session_id))
 
         # 獲取該 session 的對話歷史
-        chat_history = get_session_history(session_id)
+        chat_history = await get_session_history(challenge, session_id)
 
         # 生成針對當前命令的 prompt
-        system_prompt = get_prompt_for_command()
+        system_prompt = get_prompt_for_command(challenge, session_id)
+
+        emulator = challenge.emulator
+        if emulator is not None:
+            # 結果固定的指令直接在本地回答，不呼叫模型也不計入 token 額度
+            shell = emulator.replay(chat_history)
+            ai_response = emulator.execute(shell, command)
+            if ai_response is not None:
+                EMULATED_COMMANDS.inc(result="local")
+                await record_turn(
+                    challenge, session_id, chat_history, command, ai_response
+                )
+                if chat_message.stream:
+                    return StreamingResponse(
+                        emulated_stream(session_id, ai_response),
+                        media_type="application/x-ndjson",
+                    )
+                return {
+                    "response": ai_response,
+                    "status": "success",
+                    "session_id": session_id,
+                }
+
+            # 其餘指令交給模型，並附上目前的終端狀態
+            EMULATED_COMMANDS.inc(result="forwarded")
+            system_prompt += "\n\n" + emulator.describe(shell)
 
         # 建構對話歷史
         messages = [{"role": "system", "content": system_prompt}]
@@ -133,64 +630,214 @@ async def chat_with_terminal(chat_message: ChatMessage):
         # 添加當前指令
         messages.append({"role": "user", "content": command})
 
+        # 接近 token 額度時縮短回應，用完後拒絕
         try:
-            response = openai.ChatCompletion.create(
-                model="basic/gpt-4o-mini",
-                messages=messages,
-                max_tokens=1024,
-                temperature=0.3,
+            max_tokens = token_ledger.max_tokens_for(session_id, MAX_TOKENS)
+        except BudgetExceededError:
+            raise HTTPException(status_code=429, detail=BUDGET_MESSAGE)
+
+        # 縮短的回應不放入快取，避免提供給其他請求
+        cache_key = (
+            make_cache_key(challenge.name, system_prompt, chat_history, command)
+            if response_cache and max_tokens == MAX_TOKENS
+            else None
+        )
+
+        if chat_message.stream:
+            # 串流開始後無法再更改狀態碼，佇列已滿時先行拒絕
+            if llm_client.scheduler.full():
+                raise HTTPException(status_code=429, detail=BUSY_MESSAGE)
+
+            return StreamingResponse(
+                stream_chat(
+                    challenge,
+                    session_id,
+                    chat_history,
+                    command,
+                    messages,
+                    cache_key,
+                    max_tokens,
+                ),
+                media_type="application/x-ndjson",
+                # 避免反向代理 (nginx) 緩衝串流內容
+                headers={"X-Accel-Buffering": "no"},
             )
 
-            if not response.choices or not response.choices[0].message.content:
-                raise Exception("API 返回空回應")
-
-            ai_response = response.choices[0].message.content.strip()
-
-            # 儲存對話到該 session 的歷史
-            chat_history.append({"role": "user", "content": command})
-            chat_history.append({"role": "assistant", "content": ai_response})
+        async def complete() -> str:
+            usage: Dict[str, int] = {}
+            response = await llm_client.complete(
+                messages,
+                team=session_id,
+                max_tokens=max_tokens,
+                temperature=0.3,
+                usage=usage,
+            )
+            account_usage(challenge, session_id, messages, response, usage)
+            return response
 
-            # 限制歷史長度避免 token 過多
-            if len(chat_history) > 6:  # 保持最近 6 條訊息 (3 組對話)
-                chat_history[:] = chat_history[-6:]
+        try:
+            if cache_key:
+                # 命中快取或與進行中的相同請求共用上游結果 (只計入實際呼叫的用量)
+                ai_response = await response_cache.get_or_compute(cache_key, complete)
+            else:
+                ai_response = await complete()
 
-            # 保存到 MongoDB
-            save_to_mongodb(session_id, command, ai_response)
+            await record_turn(challenge, session_id, chat_history, command, ai_response)
 
+        except QueueFullError:
+            raise HTTPException(status_code=429, detail=BUSY_MESSAGE)
         except Exception as api_error:
-            error_msg = str(api_error)
-            ai_response = error_msg
+            logger.error(
+                f"上游 API 錯誤: {api_error}",
+                extra={"challenge": challenge.name, "team": session_id},
+            )
+            raise HTTPException(status_code=502, detail=UPSTREAM_ERROR_MESSAGE)
 
         return {"response": ai_response, "status": "success", "session_id": session_id}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Terminal error: {str(e)}")
 
 
-@app.get("/debug/state")
-async def debug_state():
-    """調試用：查看當前狀態"""
+@app.post("/chat")
+async def chat_with_terminal(chat_message: ChatMessage):
+    return await handle_chat(default_challenge, chat_message)
+
+
+@app.post("/chall/{name}/chat")
+async def chat_with_challenge(name: str, chat_message: ChatMessage):
+    return await handle_chat(get_challenge(name), chat_message)
+
+
+async def challenge_state(challenge: Challenge):
+    """查看指定挑戰的狀態"""
     try:
-        # 查詢 MongoDB 中的記錄數量
-        total_records = chall_collection.count_documents({})
-        team_stats = []
+        # 查詢 MongoDB 中各隊伍的記錄數量
+        record_stats = await challenge.cached_record_stats()
 
-        # 獲取每個隊伍的統計
-        for team_id in range(1, 11):
-            count = chall_collection.count_documents({"team_id": team_id})
-            if count > 0:
-                team_stats.append({"team_id": team_id, "message_count": count})
+        session_stats = await session_store.stats()
 
         return {
-            "total_sessions": len(session_histories),
-            "mongodb_total_records": total_records,
-            "team_statistics": team_stats,
+            "challenge": challenge.name,
+            "total_sessions": session_stats["sessions"],
+            **record_stats,
+            "mongodb_writer": mongo_writer.stats(),
+            "session_store": session_stats,
+            "response_cache": response_cache.stats() if response_cache else None,
+            "upstream_scheduler": llm_client.scheduler.stats(),
+            "token_usage": token_ledger.stats(challenge.name),
         }
     except Exception as e:
-        return {"total_sessions": len(session_histories), "mongodb_error": str(e)}
+        return {
+            "challenge": challenge.name,
+            "mongodb_error": str(e),
+            "mongodb_writer": mongo_writer.stats(),
+        }
+
+
+async def challenge_history(
+    challenge: Challenge,
+    team_id: int,
+    limit: int,
+    before: Optional[str],
+    since: Optional[str],
+):
+    if before and since:
+        raise HTTPException(status_code=400, detail="before 與 since 不能同時使用")
+
+    records, has_more = await asyncio.to_thread(
+        challenge.history,
+        team_id,
+        limit,
+        decode_cursor(before) if before else None,
+        decode_cursor(since) if since else None,
+    )
+
+    return {
+        "records": [
+            {
+                "_id": str(record["_id"]),
+                # 存入的是 UTC 時間
+                "timestamp": record["timestamp"].isoformat() + "Z",
+                "user_input": record.get("user_input", ""),
+                "ai_response": record.get("ai_response", ""),
+            }
+            for record in records
+        ],
+        "has_more": has_more,
+        # 較舊一頁的 cursor (以 before 帶入)
+        "next_cursor": (
+            encode_cursor(records[-1]) if records and has_more and not since else None
+        ),
+        # 最新一筆的 cursor (以 since 帶入輪詢新紀錄)
+        "latest_cursor": encode_cursor(records[0]) if records else since,
+    }
+
+
+def require_history_token(x_history_token: Optional[str] = Header(None)):
+    """對話紀錄含各隊的解題過程，只開放給持有 HISTORY_TOKEN 的主辦方"""
+    if not HISTORY_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_history_token is None or not secrets.compare_digest(
+        x_history_token.encode("utf-8"), HISTORY_TOKEN.encode("utf-8")
+    ):
+        raise HTTPException(status_code=401, detail="無效的 History Token")
+
+
+@app.get("/history/{team_id}", dependencies=[Depends(require_history_token)])
+async def history(
+    team_id: int,
+    limit: int = Query(50, ge=1, le=HISTORY_MAX_LIMIT),
+    before: Optional[str] = None,
+    since: Optional[str] = None,
+):
+    """分頁查詢隊伍在預設挑戰的對話紀錄"""
+    return await challenge_history(default_challenge, team_id, limit, before, since)
+
+
+@app.get(
+    "/chall/{name}/history/{team_id}", dependencies=[Depends(require_history_token)]
+)
+async def challenge_history_route(
+    name: str,
+    team_id: int,
+    limit: int = Query(50, ge=1, le=HISTORY_MAX_LIMIT),
+    before: Optional[str] = None,
+    since: Optional[str] = None,
+):
+    """分頁查詢隊伍在指定挑戰的對話紀錄"""
+    return await challenge_history(get_challenge(name), team_id, limit, before, since)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 格式的運作指標"""
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
+
+
+@app.get("/debug/state")
+async def debug_state():
+    """調試用：查看當前狀態"""
+    return await challenge_state(default_challenge)
+
+
+@app.get("/chall/{name}/debug/state")
+async def debug_challenge_state(name: str):
+    """調試用：查看指定挑戰的狀態"""
+    return await challenge_state(get_challenge(name))
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
+    if WORKERS > 1 and SESSION_BACKEND == "memory":
+        logger.warning("多個 worker 使用 memory session backend 時對話歷史不會共用")
+
+    if WORKERS > 1:
+        # 多 worker 模式需以 import 字串載入 app，各 worker 會重新 import 本模組
+        uvicorn.run("main:app", host="0.0.0.0", port=PORT, workers=WORKERS)
+    else:
+        # 直接傳入 app，避免 uvicorn 再 import 一次 main
+        uvicorn.run(app, host="0.0.0.0", port=PORT)
@@ -0,0 +1,134 @@
+"""背景批次寫入 MongoDB"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from common.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+INSERT_SECONDS = Histogram(
+    "chall_mongo_insert_seconds", "MongoDB insert_many time per batch", ["collection"]
+)
+RECORDS = Counter(
+    "chall_mongo_records_total", "Chat records by write result", ["result"]
+)
+
+# 關閉時放入佇列的結束標記，確保之前的記錄都已寫入
+_STOP = object()
+
+
+class MongoWriter:
+    """以佇列收集記錄，依筆數或時間批次寫入 MongoDB 各 collection"""
+
+    def __init__(
+        self,
+        db,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_queue: int = 10000,
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.worker: Optional[asyncio.Task] = None
+        self.closed = False
+
+        # 統計數據
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, collection_name: str, document: Dict[str, Any]) -> bool:
+        """將記錄放入佇列，佇列已滿或已關閉時丟棄"""
+        if self.closed:
+            self.dropped += 1
+            RECORDS.inc(result="dropped")
+            return False
+
+        try:
+            self.queue.put_nowait((collection_name, document))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            RECORDS.inc(result="dropped")
+            return False
+
+    def start(self):
+        """啟動背景寫入任務"""
+        if self.worker is None:
+            self.worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        """停止接收新記錄並寫完佇列中剩餘的記錄"""
+        if self.closed:
+            return
+        self.closed = True
+
+        if self.worker is None:
+            return
+
+        await self.queue.put(_STOP)
+        await self.worker
+
+    def stats(self) -> Dict[str, int]:
+        """佇列與寫入統計"""
+        return {
+            "queue_depth": self.queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+
+            # 收集到 batch_size 筆或等到 flush_interval 為止
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: List[Tuple[str, Dict[str, Any]]]):
+        grouped: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for collection_name, document in batch:
+            grouped[collection_name].append(document)
+
+        for collection_name, documents in grouped.items():
+            try:
+                with INSERT_SECONDS.time(collection=collection_name):
+                    await asyncio.to_thread(
+                        self.db[collection_name].insert_many, documents, ordered=False
+                    )
+                self.written += len(documents)
+                RECORDS.inc(len(documents), result="written")
+            except Exception as e:
+                self.failed += len(documents)
+                RECORDS.inc(len(documents), result="failed")
+                logger.error(
+                    f"MongoDB 批次寫入 {collection_name} 失敗 ({len(documents)} 筆): {e}"
+                )
@@ -0,0 +1,56 @@
+"""Prompt 檔案快取"""
+
+import logging
+import os
+import time
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PromptCache:
+    """將 prompt 檔案保存在記憶體，依 mtime 自動重新載入"""
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        # path -> (內容, (mtime_ns, size), 上次檢查時間)
+        self.entries: Dict[str, Tuple[str, Tuple[int, int], float]] = {}
+
+    def load(self, path: str) -> str:
+        """讀取檔案並放入快取，讀取期間檔案被修改則拋出錯誤"""
+        before = os.stat(path)
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+        after = os.stat(path)
+
+        signature = (after.st_mtime_ns, after.st_size)
+        if (before.st_mtime_ns, before.st_size) != signature:
+            raise OSError(f"Prompt 檔案在讀取期間被修改: {path}")
+        if not content.strip():
+            raise OSError(f"Prompt 檔案為空: {path}")
+
+        self.entries[path] = (content, signature, time.monotonic())
+        return content
+
+    def get(self, path: str) -> str:
+        """獲取 prompt 內容，檔案更新時重新載入"""
+        entry = self.entries.get(path)
+        if entry is None:
+            return self.load(path)
+
+        content, signature, checked_at = entry
+        now = time.monotonic()
+        if now - checked_at < self.check_interval:
+            return content
+
+        try:
+            st = os.stat(path)
+            if (st.st_mtime_ns, st.st_size) == signature:
+                self.entries[path] = (content, signature, now)
+                return content
+            return self.load(path)
+        except (OSError, UnicodeDecodeError) as e:
+            # 檔案正在寫入或暫時不存在時繼續使用舊內容，下次再檢查
+            logger.warning(f"Prompt 重新載入失敗，沿用舊內容: {e}")
+            self.entries[path] = (content, signature, now)
+            return content
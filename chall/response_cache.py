@@ -0,0 +1,158 @@
+"""相同指令的回應快取"""
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from common.metrics import Counter
+
+CACHE_LOOKUPS = Counter(
+    "chall_response_cache_total", "Response cache lookups by result", ["result"]
+)
+
+
+class CoalescedRequestError(Exception):
+    """共用結果的請求在完成前中斷 (例如使用者取消串流)"""
+
+
+def make_cache_key(
+    challenge: str, system_prompt: str, history: List[Dict[str, str]], command: str
+) -> str:
+    """以挑戰、prompt 雜湊、正規化後的歷史與指令組成快取 key"""
+    prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    normalized = {
+        "challenge": challenge,
+        "prompt": prompt_hash,
+        "history": [
+            [message["role"], " ".join(message["content"].split())]
+            for message in history
+        ],
+        "command": " ".join(command.split()),
+    }
+    payload = json.dumps(normalized, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL 回應快取，並合併同時送出的相同請求"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.inflight: Dict[str, asyncio.Future] = {}
+
+        # 統計數據
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """獲取未過期的快取回應"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        response, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return response
+
+    def lookup(self, key: str) -> Tuple[Optional[str], Optional[asyncio.Future]]:
+        """串流路徑使用：回傳 (快取回應, 進行中的相同請求) 並計入統計
+
+        兩者皆為 None 時應以 register 登記，完成後以 resolve 通知等待者。
+        """
+        response = self.get(key)
+        if response is not None:
+            self.hits += 1
+            CACHE_LOOKUPS.inc(result="hit")
+            return response, None
+
+        future = self.inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            CACHE_LOOKUPS.inc(result="coalesced")
+            return None, future
+
+        self.misses += 1
+        CACHE_LOOKUPS.inc(result="miss")
+        return None, None
+
+    def register(self, key: str) -> asyncio.Future:
+        """登記進行中的請求，相同的請求會等待它的結果"""
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        return future
+
+    def resolve(
+        self,
+        key: str,
+        future: asyncio.Future,
+        response: Optional[str] = None,
+        error: Optional[BaseException] = None,
+    ):
+        """完成 register 登記的請求：成功時寫入快取，失敗時將例外交給等待者"""
+        if self.inflight.get(key) is future:
+            del self.inflight[key]
+        if future.done():
+            return
+
+        if response is not None:
+            self.put(key, response)
+            future.set_result(response)
+        else:
+            future.set_exception(error or CoalescedRequestError("請求已中斷"))
+            # 標記例外已被讀取，避免沒有等待者時產生警告
+            future.exception()
+
+    def put(self, key: str, response: str):
+        """寫入快取並淘汰最久未使用的項目"""
+        self.entries[key] = (response, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get_or_compute(
+        self, key: str, compute: Callable[[], Awaitable[str]]
+    ) -> str:
+        """命中快取則直接回傳，否則只讓一個請求呼叫上游，其餘等待同一結果"""
+        response = self.get(key)
+        if response is not None:
+            self.hits += 1
+            CACHE_LOOKUPS.inc(result="hit")
+            return response
+
+        future = self.inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            CACHE_LOOKUPS.inc(result="coalesced")
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        CACHE_LOOKUPS.inc(result="miss")
+        future = self.register(key)
+        try:
+            response = await compute()
+        except BaseException as e:
+            # 被取消時等待者改收到 CoalescedRequestError，而不是一併被取消
+            self.resolve(key, future, error=e if isinstance(e, Exception) else None)
+            raise
+        self.resolve(key, future, response)
+        return response
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,118 @@
+"""上游請求排程：全域併發上限與依隊伍輪流的公平佇列"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+
+from common.metrics import Counter, Histogram
+
+QUEUE_WAIT_SECONDS = Histogram(
+    "chall_upstream_queue_wait_seconds", "Time spent waiting for an upstream slot"
+)
+QUEUE_REJECTED = Counter(
+    "chall_upstream_queue_rejected_total",
+    "Requests rejected because the queue was full",
+)
+
+
+class QueueFullError(Exception):
+    """等待上游的佇列已滿"""
+
+
+class FairScheduler:
+    """限制同時呼叫上游的數量，等待中的請求依 team 輪流取得執行權"""
+
+    def __init__(self, max_concurrency: int = 16, max_queue: int = 64):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.queued = 0
+        # team -> 等待中的 future，順序即輪流順序
+        self.queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+        # 統計數據
+        self.rejected = 0
+
+    def full(self) -> bool:
+        """佇列是否已滿，新請求會被拒絕"""
+        return self.active >= self.max_concurrency and self.queued >= self.max_queue
+
+    async def acquire(self, team: str):
+        """取得一個上游執行名額，佇列已滿時立即拋出 QueueFullError"""
+        if self.active < self.max_concurrency and self.queued == 0:
+            self.active += 1
+            QUEUE_WAIT_SECONDS.observe(0)
+            return
+
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            QUEUE_REJECTED.inc()
+            raise QueueFullError("上游請求佇列已滿")
+
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(team, deque()).append(future)
+        self.queued += 1
+
+        started = time.perf_counter()
+        try:
+            await future
+            QUEUE_WAIT_SECONDS.observe(time.perf_counter() - started)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已取得名額後才被取消，歸還名額
+                self.release()
+            else:
+                self._remove(team, future)
+            raise
+
+    def release(self):
+        """歸還執行名額並喚醒下一個 team 的請求"""
+        self.active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, team: str):
+        await self.acquire(team)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "waiting_teams": len(self.queues),
+            "rejected": self.rejected,
+        }
+
+    def _dispatch(self):
+        while self.active < self.max_concurrency and self.queues:
+            team, queue = next(iter(self.queues.items()))
+            future = queue.popleft()
+            self.queued -= 1
+
+            # 輪到的 team 移到最後，讓其他 team 先取得下一個名額
+            if queue:
+                self.queues.move_to_end(team)
+            else:
+                del self.queues[team]
+
+            # 已取消的請求 (例如串流用戶在等待時斷線) 不佔用名額
+            if future.done():
+                continue
+
+            self.active += 1
+            future.set_result(None)
+
+    def _remove(self, team: str, future: asyncio.Future):
+        queue = self.queues.get(team)
+        if queue is None or future not in queue:
+            return
+
+        queue.remove(future)
+        self.queued -= 1
+        if not queue:
+            del self.queues[team]
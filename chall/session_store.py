@@ -0,0 +1,161 @@
+"""Session 對話歷史儲存"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List
+
+# 每則訊息的固定 token 開銷 (role、分隔符號等)
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估文字的 token 數：ASCII 約 4 字元一個 token，其他字元 (中文等) 約一字一個"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def trim_history(
+    history: List[Dict[str, str]], max_tokens: int
+) -> List[Dict[str, str]]:
+    """從最新的訊息往回保留，直到超過 token 預算為止"""
+    total = 0
+    start = len(history)
+
+    # 以 (user, assistant) 一組為單位，避免只留下半輪對話
+    while start >= 2:
+        cost = sum(
+            estimate_tokens(message["content"]) + MESSAGE_TOKEN_OVERHEAD
+            for message in history[start - 2 : start]
+        )
+        if total + cost > max_tokens:
+            break
+        total += cost
+        start -= 2
+
+    return history[start:]
+
+
+def _history_size(history: List[Dict[str, str]]) -> int:
+    return sum(len(message["content"].encode("utf-8")) for message in history)
+
+
+class SessionStore:
+    """Session 歷史儲存介面"""
+
+    async def get(self, session_id: str) -> List[Dict[str, str]]:
+        """獲取 session 歷史，不存在則回傳空列表"""
+        raise NotImplementedError
+
+    async def set(self, session_id: str, history: List[Dict[str, str]]):
+        """覆寫 session 歷史"""
+        raise NotImplementedError
+
+    async def stats(self) -> Dict[str, Any]:
+        """儲存狀態統計"""
+        raise NotImplementedError
+
+    def ensure_indexes(self):
+        """建立需要的 index，應在 startup 時呼叫"""
+
+
+class InMemorySessionStore(SessionStore):
+    """行程內的 session 歷史儲存，依 LRU、TTL 與記憶體用量淘汰（僅適用單一 worker）"""
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        ttl: float = 6 * 3600,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # session_id -> (history, 最後存取時間, 位元組數)，順序即 LRU 順序
+        self.sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self.total_bytes = 0
+        self.evicted = 0
+
+    async def get(self, session_id: str) -> List[Dict[str, str]]:
+        self._expire()
+
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            return []
+
+        history, _, size = entry
+        self.sessions[session_id] = (history, time.monotonic(), size)
+        self.sessions.move_to_end(session_id)
+        return list(history)
+
+    async def set(self, session_id: str, history: List[Dict[str, str]]):
+        old = self.sessions.pop(session_id, None)
+        if old is not None:
+            self.total_bytes -= old[2]
+
+        size = _history_size(history)
+        self.sessions[session_id] = (list(history), time.monotonic(), size)
+        self.total_bytes += size
+
+        self._expire()
+        while self.sessions and (
+            len(self.sessions) > self.max_sessions or self.total_bytes > self.max_bytes
+        ):
+            self._pop_oldest()
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "sessions": len(self.sessions),
+            "bytes": self.total_bytes,
+            "evicted": self.evicted,
+        }
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        while self.sessions:
+            _, accessed_at, _ = next(iter(self.sessions.values()))
+            if accessed_at > deadline:
+                break
+            self._pop_oldest()
+
+    def _pop_oldest(self):
+        _, (_, _, size) = self.sessions.popitem(last=False)
+        self.total_bytes -= size
+        self.evicted += 1
+
+
+class MongoSessionStore(SessionStore):
+    """存放在 MongoDB 的 session 歷史，多個 worker 可共用"""
+
+    def __init__(self, collection, ttl: float = 6 * 3600):
+        self.collection = collection
+        self.ttl = ttl
+
+    def ensure_indexes(self):
+        # 由 MongoDB 的 TTL index 清除閒置的 session
+        self.collection.create_index("updated_at", expireAfterSeconds=int(self.ttl))
+
+    async def get(self, session_id: str) -> List[Dict[str, str]]:
+        document = await asyncio.to_thread(
+            self.collection.find_one, {"_id": session_id}, {"history": 1}
+        )
+        return document["history"] if document else []
+
+    async def set(self, session_id: str, history: List[Dict[str, str]]):
+        await asyncio.to_thread(
+            self.collection.update_one,
+            {"_id": session_id},
+            {
+                "$set": {
+                    "history": history,
+                    "updated_at": datetime.utcnow(),
+                }
+            },
+            upsert=True,
+        )
+
+    async def stats(self) -> Dict[str, Any]:
+        sessions = await asyncio.to_thread(self.collection.count_documents, {})
+        return {"backend": "mongo", "sessions": sessions}
@@ -88,6 +88,8 @@ class Terminal {
     this.commandHistory = [];
     this.historyIndex = -1;
     this.sessionId = this.getOrCreateSessionId();
+    // 多挑戰模式下由頁面指定對應的 chat 路徑
+    this.chatUrl = document.body.dataset.chatUrl || "/chat";
 
     this.setupEventListeners();
 
@@ -160,17 +162,15 @@ class Terminal {
     this.showTypingIndicator();
 
     try {
-      const response = await this.sendToChatAPI(command);
-      this.hideTypingIndicator();
-      this.addAIResponse(response.response);
+      await this.streamFromChatAPI(command);
     } catch (error) {
       this.hideTypingIndicator();
       this.addErrorMessage(`錯誤: ${error.message}`);
     }
   }
 
-  async sendToChatAPI(message) {
-    const response = await fetch("/chat", {
+  async streamFromChatAPI(message) {
+    const response = await fetch(this.chatUrl, {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
@@ -178,14 +178,60 @@ class Terminal {
       body: JSON.stringify({
         message: message,
         session_id: this.sessionId,
+        stream: true,
       }),
     });
 
     if (!response.ok) {
-      throw new Error(`HTTP ${response.status}`);
+      // 優先顯示伺服器回傳的錯誤說明 (例如 429 忙碌中)
+      let detail = `HTTP ${response.status}`;
+      try {
+        const body = await response.json();
+        if (body.detail) detail = body.detail;
+      } catch (e) {}
+      throw new Error(detail);
+    }
+
+    // 逐行讀取 NDJSON，收到內容就即時顯示
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let line = null;
+    let text = "";
+
+    const handleEvent = (event) => {
+      if (event.error) {
+        throw new Error(event.error);
+      }
+      if (event.delta) {
+        if (!line) {
+          this.hideTypingIndicator();
+          line = this.addLine("", "ai-response");
+        }
+        text += event.delta;
+        line.textContent = text.replace("```", "");
+        this.scrollToBottom();
+      }
+      if (event.done && !line) {
+        this.hideTypingIndicator();
+        this.addAIResponse(event.response);
+      }
+    };
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split("\n");
+      buffer = lines.pop();
+      lines.filter((l) => l.trim()).forEach((l) => handleEvent(JSON.parse(l)));
     }
 
-    return await response.json();
+    if (buffer.trim()) {
+      handleEvent(JSON.parse(buffer));
+    }
+    this.hideTypingIndicator();
   }
 
   clearTerminal() {
@@ -211,6 +257,7 @@ class Terminal {
     div.textContent = text.replace("```", "");
     this.output.appendChild(div);
     this.scrollToBottom();
+    return div;
   }
 
   showTypingIndicator() {
@@ -0,0 +1,58 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+CHALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(CHALL_DIR))
+sys.path.insert(0, CHALL_DIR)
+
+from response_cache import CoalescedRequestError, ResponseCache  # noqa: E402
+
+
+def test_stream_waiter_shares_registered_result():
+    """串流請求登記後，相同的請求等待同一結果而不另外呼叫上游"""
+
+    async def scenario():
+        cache = ResponseCache()
+        assert cache.lookup("key") == (None, None)
+        future = cache.register("key")
+
+        cached, pending = cache.lookup("key")
+        assert cached is None and pending is future
+
+        cache.resolve("key", future, "output")
+        assert await pending == "output"
+        assert cache.lookup("key") == ("output", None)
+        assert cache.inflight == {}
+        assert cache.stats()["coalesced"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_leader_fails_waiters():
+    """呼叫上游的請求被取消時，等待者收到錯誤而不是一併被取消"""
+
+    async def scenario():
+        cache = ResponseCache()
+        started = asyncio.Event()
+
+        async def compute():
+            started.set()
+            await asyncio.sleep(10)
+            return "output"
+
+        leader = asyncio.create_task(cache.get_or_compute("key", compute))
+        await started.wait()
+        waiter = asyncio.create_task(cache.get_or_compute("key", compute))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        with pytest.raises(CoalescedRequestError):
+            await waiter
+        assert cache.inflight == {}
+
+    asyncio.run(scenario())
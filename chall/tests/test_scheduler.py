@@ -0,0 +1,35 @@
+import asyncio
+import os
+import sys
+
+CHALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(CHALL_DIR))
+sys.path.insert(0, CHALL_DIR)
+
+from scheduler import FairScheduler  # noqa: E402
+
+
+def test_release_skips_cancelled_waiter():
+    """等待中被取消的請求不應佔走 release 歸還的名額"""
+
+    async def scenario():
+        scheduler = FairScheduler(max_concurrency=1, max_queue=4)
+        await scheduler.acquire("1")
+
+        waiter = asyncio.create_task(scheduler.acquire("2"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        # 在 waiter 處理取消之前歸還名額
+        scheduler.release()
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        assert scheduler.stats()["active"] == 0
+        assert scheduler.stats()["queued"] == 0
+
+        await asyncio.wait_for(scheduler.acquire("3"), timeout=1)
+        assert scheduler.stats()["active"] == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,177 @@
+"""各隊伍 / 挑戰的上游 token 用量統計與預算"""
+
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from common.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+BUDGET_DECISIONS = Counter(
+    "chall_token_budget_total", "Requests limited by the token budget", ["result"]
+)
+
+
+class BudgetExceededError(Exception):
+    """隊伍已用完 token 額度"""
+
+
+class TokenLedger:
+    """在記憶體中累計 token 用量並定期批次寫入 MongoDB
+
+    budget 為每隊在 window 秒內可使用的 token 數 (0 表示不限制，window 為 0
+    表示整個活動期間)。用量超過 soft_ratio 後逐步降低 max_tokens，用完後拒絕請求。
+    """
+
+    def __init__(
+        self,
+        collection,
+        budget: int = 0,
+        window: float = 0.0,
+        soft_ratio: float = 0.8,
+        min_max_tokens: int = 128,
+        flush_interval: float = 10.0,
+    ):
+        self.collection = collection
+        self.budget = budget
+        self.window = window
+        self.soft_ratio = soft_ratio
+        self.min_max_tokens = min_max_tokens
+        self.flush_interval = flush_interval
+
+        # (challenge, team) -> [prompt_tokens, completion_tokens, requests]
+        self.totals: Dict[Tuple[str, str], list] = defaultdict(lambda: [0, 0, 0])
+        # 尚未寫入 MongoDB 的增量
+        self.pending: Dict[Tuple[str, str], list] = defaultdict(lambda: [0, 0, 0])
+        # team -> 目前預算區間內已使用的 token
+        self.window_usage: Dict[str, int] = defaultdict(int)
+        self.window_started = time.monotonic()
+
+        self.worker: Optional[asyncio.Task] = None
+        self.wakeup = asyncio.Event()
+        self.closing = False
+
+    def load(self):
+        """從 MongoDB 載入累計用量，重新啟動後預算不會歸零"""
+        for document in self.collection.find():
+            key = (document["challenge"], str(document["team_id"]))
+            self.totals[key] = [
+                document.get("prompt_tokens", 0),
+                document.get("completion_tokens", 0),
+                document.get("requests", 0),
+            ]
+            if not self.window:
+                self.window_usage[key[1]] += self.totals[key][0] + self.totals[key][1]
+
+    def _roll_window(self):
+        if self.window and time.monotonic() - self.window_started >= self.window:
+            self.window_usage.clear()
+            self.window_started = time.monotonic()
+
+    def max_tokens_for(self, team: str, default: int) -> int:
+        """依剩餘額度決定 max_tokens，額度用完時拋出 BudgetExceededError"""
+        if self.budget <= 0:
+            return default
+
+        self._roll_window()
+        used = self.window_usage[team]
+        if used >= self.budget:
+            BUDGET_DECISIONS.inc(result="refused")
+            raise BudgetExceededError(f"隊伍 {team} 的 token 額度已用完")
+
+        soft_limit = self.budget * self.soft_ratio
+        if used < soft_limit:
+            return default
+
+        # 超過軟性上限後，max_tokens 隨剩餘額度線性遞減
+        remaining = (self.budget - used) / (self.budget - soft_limit)
+        BUDGET_DECISIONS.inc(result="degraded")
+        return max(self.min_max_tokens, min(default, int(default * remaining)))
+
+    def record(self, challenge: str, team: str, prompt: int, completion: int):
+        """記錄一次上游呼叫的 token 用量"""
+        self._roll_window()
+        for entry in (self.totals[(challenge, team)], self.pending[(challenge, team)]):
+            entry[0] += prompt
+            entry[1] += completion
+            entry[2] += 1
+        self.window_usage[team] += prompt + completion
+
+    def start(self):
+        """啟動背景寫入任務"""
+        if self.worker is None:
+            self.worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        """寫入剩餘的用量後停止"""
+        self.closing = True
+        self.wakeup.set()
+        if self.worker is not None:
+            await self.worker
+        await self._flush()
+
+    async def _run(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self._flush()
+
+    async def _flush(self):
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, defaultdict(lambda: [0, 0, 0])
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {"_id": f"{challenge}:{team}"},
+                {
+                    "$inc": {
+                        "prompt_tokens": prompt,
+                        "completion_tokens": completion,
+                        "requests": requests,
+                    },
+                    "$set": {
+                        "challenge": challenge,
+                        "team_id": team,
+                        "updated_at": now,
+                    },
+                },
+                upsert=True,
+            )
+            for (challenge, team), (prompt, completion, requests) in pending.items()
+        ]
+
+        try:
+            await asyncio.to_thread(
+                self.collection.bulk_write, operations, ordered=False
+            )
+        except Exception as e:
+            # 放回待寫入的增量，下次再試
+            for key, values in pending.items():
+                entry = self.pending[key]
+                for index, value in enumerate(values):
+                    entry[index] += value
+            logger.error(f"Token 用量寫入失敗: {e}")
+
+    def stats(self, challenge: str) -> Dict[str, Any]:
+        """指定挑戰各隊伍的用量"""
+        teams = {
+            team: {
+                "prompt_tokens": prompt,
+                "completion_tokens": completion,
+                "requests": requests,
+                "window_usage": self.window_usage.get(team, 0),
+            }
+            for (name, team), (prompt, completion, requests) in self.totals.items()
+            if name == challenge
+        }
+        return {"budget": self.budget, "window": self.window, "teams": teams}
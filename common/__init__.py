@@ -0,0 +1 @@
+"""chall 與 panel 共用的模組"""
@@ -0,0 +1,187 @@
+"""預先壓縮的靜態檔案與預先渲染的頁面 (chall 與 panel 共用)
+
+內容在第一次使用時 (靜態檔案為啟動時) 壓縮並計算雜湊，之後的請求只需依
+Accept-Encoding 挑選版本並比對 ETag。
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+from typing import Any, Dict, Hashable, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+from fastapi.templating import Jinja2Templates
+
+from common.metrics import TEMPLATE_RENDER_SECONDS, Counter
+
+try:
+    import brotli
+except ImportError:  # 選用套件，未安裝時只提供 gzip
+    brotli = None
+
+CACHED_RESPONSES = Counter(
+    "cached_responses_total",
+    "Precompressed static asset and page responses by encoding",
+    ["kind", "encoding"],
+)
+
+# 網址含內容雜湊，內容改變時網址也會改變
+IMMUTABLE = "public, max-age=31536000, immutable"
+# 每次都向伺服器確認，內容未變時回應 304
+REVALIDATE = "no-cache"
+
+# 太小的內容壓縮後不會變小
+MIN_COMPRESS_SIZE = 256
+
+
+def _accepted_encodings(header: str) -> Dict[str, float]:
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    # 比對時忽略弱 ETag 前綴 (RFC 9110 的 If-None-Match 使用弱比較)
+    return "*" in tags or etag in (
+        tag[2:] if tag.startswith("W/") else tag for tag in tags
+    )
+
+
+class Representation:
+    """單一內容與其 gzip / brotli 版本"""
+
+    def __init__(self, body: bytes, media_type: str, kind: str):
+        self.media_type = media_type
+        self.kind = kind
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.bodies: Dict[str, bytes] = {"identity": body}
+
+        if len(body) >= MIN_COMPRESS_SIZE:
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.bodies["gzip"] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.bodies["br"] = compressed
+
+    def negotiate(self, header: str) -> str:
+        """依 Accept-Encoding 選擇最小的可用版本"""
+        accepted = _accepted_encodings(header)
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and accepted.get(encoding, 0) > 0:
+                return encoding
+        return "identity"
+
+    def response(self, request: Request, cache_control: str) -> Response:
+        encoding = self.negotiate(request.headers.get("accept-encoding", ""))
+        # 各編碼的內容不同，ETag 也要不同
+        if encoding == "identity":
+            etag = f'"{self.digest}"'
+        else:
+            etag = f'"{self.digest}-{encoding}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding",
+        }
+
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            CACHED_RESPONSES.inc(kind=self.kind, encoding="not_modified")
+            return Response(status_code=304, headers=headers)
+
+        CACHED_RESPONSES.inc(kind=self.kind, encoding=encoding)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(
+            self.bodies[encoding], media_type=self.media_type, headers=headers
+        )
+
+
+class StaticAssets:
+    """啟動時 (load) 讀入並壓縮整個靜態目錄，以內容雜湊命名網址
+
+    模板中以 static_url("style.css") 取得 /static/style.<hash>.css，
+    這類網址可永久快取；原本的 /static/style.css 仍可使用但每次需重新驗證。
+    """
+
+    def __init__(self, directory: str, prefix: str = "/static"):
+        self.directory = directory
+        self.prefix = prefix.rstrip("/")
+        # 相對路徑 -> 內容
+        self.files: Dict[str, Representation] = {}
+        # 相對路徑 -> 含雜湊的網址
+        self.urls: Dict[str, str] = {}
+        # 含雜湊的路徑 -> 相對路徑
+        self.hashed: Dict[str, str] = {}
+
+    def load(self):
+        """讀入並壓縮所有檔案，應在 startup 時呼叫"""
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    body = f.read()
+                media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                asset = Representation(body, media_type, "static")
+
+                stem, extension = posixpath.splitext(relative)
+                hashed = f"{stem}.{asset.digest[:10]}{extension}"
+                self.files[relative] = asset
+                self.hashed[hashed] = relative
+                self.urls[relative] = f"{self.prefix}/{hashed}"
+
+    def url(self, path: str) -> str:
+        """模板使用的網址，檔案不存在時拋出 KeyError 以便及早發現"""
+        return self.urls[path]
+
+    def response(self, request: Request, path: str) -> Response:
+        relative = self.hashed.get(path)
+        if relative is not None:
+            return self.files[relative].response(request, IMMUTABLE)
+
+        asset = self.files.get(path)
+        if asset is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        return asset.response(request, REVALIDATE)
+
+
+class PageCache:
+    """渲染結果只取決於 key 的頁面，第一次請求時渲染並壓縮，之後直接回傳
+
+    key 需涵蓋模板用到的所有輸入 (例如關卡與 data.json 的版本)。
+    """
+
+    def __init__(self, templates: Jinja2Templates, max_entries: int = 256):
+        self.templates = templates
+        self.max_entries = max_entries
+        self.pages: Dict[Hashable, Representation] = {}
+
+    def get(self, key: Hashable, name: str, context: Dict[str, Any]) -> Representation:
+        page = self.pages.get(key)
+        if page is None:
+            with TEMPLATE_RENDER_SECONDS.time(template=name):
+                html = self.templates.get_template(name).render(context)
+            page = Representation(html.encode("utf-8"), "text/html", "page")
+            # key 含版本時舊的頁面不會再被使用，超過上限就全部清除
+            if len(self.pages) >= self.max_entries:
+                self.pages.clear()
+            self.pages[key] = page
+        return page
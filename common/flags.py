@@ -0,0 +1,57 @@
+"""每隊專屬 flag 的衍生與驗證
+
+隊伍 flag 由基礎 flag 加上 HMAC(secret, 隊伍, 關卡, 內容) 組成，例如
+SITCON{c47_m03wwww} -> SITCON{c47_m03wwww_1f0c9a7d3b2e4a65}。
+驗證時只需重新計算 HMAC，不需要為每個隊伍保存 flag。
+"""
+
+import hashlib
+import hmac
+import re
+
+FLAG_PREFIX = "SITCON"
+# 隊伍標記長度 (十六進位字元數)
+TAG_LENGTH = 16
+
+FLAG_PATTERN = re.compile(re.escape(FLAG_PREFIX) + r"\{([^{}\s]*)\}")
+
+
+def team_tag(secret: str, team, level: int, body: str) -> str:
+    """計算隊伍在指定關卡的 flag 標記
+
+    team 先轉為整數，chall 的 session 字串 ("03") 與 panel 的隊伍編號 (3)
+    會得到相同的標記；非整數時拋出 ValueError。
+    """
+    message = f"{int(team)}:{level}:{body}".encode("utf-8")
+    digest = hmac.new(secret.encode("utf-8"), message, hashlib.sha256)
+    return digest.hexdigest()[:TAG_LENGTH]
+
+
+def derive_flag(secret: str, team, level: int, flag: str) -> str:
+    """將基礎 flag 轉換為隊伍專屬 flag"""
+    match = FLAG_PATTERN.fullmatch(flag)
+    if match is None:
+        raise ValueError(f"Flag 格式錯誤: {flag}")
+
+    body = match.group(1)
+    return f"{FLAG_PREFIX}{{{body}_{team_tag(secret, team, level, body)}}}"
+
+
+def render_flags(text: str, secret: str, team, level: int) -> str:
+    """將文字中所有基礎 flag 替換為隊伍專屬 flag"""
+    return FLAG_PATTERN.sub(
+        lambda match: derive_flag(secret, team, level, match.group(0)), text
+    )
+
+
+def verify_flag(secret: str, team, level: int, flag: str) -> bool:
+    """重新計算 HMAC 驗證隊伍專屬 flag"""
+    match = FLAG_PATTERN.fullmatch(flag)
+    if match is None:
+        return False
+
+    body, sep, tag = match.group(1).rpartition("_")
+    if not sep:
+        return False
+
+    return hmac.compare_digest(tag, team_tag(secret, team, level, body))
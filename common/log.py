@@ -0,0 +1,111 @@
+"""非阻塞的 JSON 日誌設定 (chall 與 panel 共用)
+
+請求處理中的 logger 呼叫只會把記錄放進佇列，實際的格式化與檔案寫入
+由 QueueListener 的背景執行緒處理。
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+from datetime import datetime, timezone
+from typing import Optional
+
+# LogRecord 的內建屬性，其餘屬性 (logger 呼叫時的 extra) 會輸出為 JSON 欄位
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+}
+
+# 每個行程只設定一次；uvicorn 以 import 字串啟動時本模組仍只會載入一次
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JSONFormatter(logging.Formatter):
+    """將每筆記錄輸出為一行 JSON"""
+
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                # 不覆寫基本欄位
+                entry.setdefault(key, value)
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """只合併訊息參數並保留例外文字，格式化交給背景執行緒"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # traceback 物件無法安全地跨執行緒保留，先轉為文字
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(
+    service: str,
+    log_file: Optional[str] = None,
+    level: str = "INFO",
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+) -> logging.handlers.QueueListener:
+    """將 root logger 改為佇列輸出，背景寫入 stderr 與依大小輪替的檔案
+
+    重複呼叫時 (例如 main 模組被 import 兩次) 沿用已啟動的 listener。
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = JSONFormatter(service)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(
+            logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=max_bytes,
+                backupCount=backup_count,
+                encoding="utf-8",
+            )
+        )
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(log_queue))
+    root.setLevel(level.upper())
+
+    listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    # 結束時寫完佇列中剩餘的記錄
+    atexit.register(listener.stop)
+    _listener = listener
+    return listener
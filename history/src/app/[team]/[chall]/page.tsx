@@ -1,18 +1,25 @@
 "use client";
 
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { useParams } from "next/navigation";
 import Link from "next/link";
 
 interface ChatHistory {
   _id: string;
-  team_id: number;
   timestamp: string;
   user_input: string;
   ai_response: string;
-  challenge: string;
 }
 
+interface HistoryPage {
+  records: ChatHistory[];
+  has_more: boolean;
+  next_cursor: string | null;
+  latest_cursor: string | null;
+}
+
+const PAGE_SIZE = 50;
+
 export default function ChallengePage() {
   const params = useParams();
   const team = params.team as string;
@@ -21,28 +28,48 @@ export default function ChallengePage() {
   const [history, setHistory] = useState<ChatHistory[]>([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
+  // 較舊一頁的 cursor，null 表示已載入全部
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  // 最新一筆的 cursor，輪詢時只取比它新的紀錄；尚無紀錄時為 null
+  const latestCursor = useRef<string | null>(null);
+  // 第一次載入是否已完成
+  const loaded = useRef(false);
+  // 上一次輪詢尚未完成時跳過，避免重複加入同一批紀錄
+  const polling = useRef(false);
 
   useEffect(() => {
+    latestCursor.current = null;
+    loaded.current = false;
     fetchHistory(true); // Initial load
     const interval = setInterval(() => {
-      fetchHistory(false); // Subsequent automatic refreshes
+      fetchNewer(); // Subsequent automatic refreshes
     }, 2000);
     return () => clearInterval(interval);
   }, [team, chall]);
 
+  const fetchPage = async (query: Record<string, string>) => {
+    const search = new URLSearchParams({ limit: String(PAGE_SIZE), ...query });
+    const response = await fetch(`/api/history/${team}/${chall}?${search}`);
+
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+    }
+
+    return (await response.json()) as HistoryPage;
+  };
+
   const fetchHistory = async (isInitialLoad = false) => {
     try {
       if (isInitialLoad) {
         setLoading(true);
       }
-      const response = await fetch(`/api/history/${team}/${chall}`);
-
-      if (!response.ok) {
-        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-      }
-
-      const data = await response.json();
-      setHistory(data);
+      const page = await fetchPage({});
+      latestCursor.current = page.latest_cursor;
+      setHistory(page.records);
+      setNextCursor(page.next_cursor);
+      setError(null);
+      loaded.current = true;
     } catch (err) {
       setError(err instanceof Error ? err.message : "載入失敗");
     } finally {
@@ -52,6 +79,50 @@ export default function ChallengePage() {
     }
   };
 
+  const fetchNewer = async () => {
+    // 尚未完成第一次載入
+    if (!loaded.current || polling.current) {
+      return;
+    }
+    polling.current = true;
+    try {
+      // 隊伍還沒有任何紀錄時沒有 cursor，重新取得第一頁
+      if (latestCursor.current === null) {
+        await fetchHistory(false);
+        return;
+      }
+      let page: HistoryPage;
+      do {
+        page = await fetchPage({ since: latestCursor.current as string });
+        latestCursor.current = page.latest_cursor;
+        const records = page.records;
+        if (records.length > 0) {
+          setHistory((previous) => [...records, ...previous]);
+        }
+      } while (page.has_more);
+    } catch (err) {
+      setError(err instanceof Error ? err.message : "載入失敗");
+    } finally {
+      polling.current = false;
+    }
+  };
+
+  const fetchOlder = async () => {
+    if (!nextCursor) {
+      return;
+    }
+    try {
+      setLoadingOlder(true);
+      const page = await fetchPage({ before: nextCursor });
+      setHistory((previous) => [...previous, ...page.records]);
+      setNextCursor(page.next_cursor);
+    } catch (err) {
+      setError(err instanceof Error ? err.message : "載入失敗");
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const formatTimestamp = (timestamp: string) => {
     return new Date(timestamp).toLocaleString("zh-TW", {
       year: "numeric",
@@ -153,6 +224,15 @@ export default function ChallengePage() {
                     </div>
                   </div>
                 ))}
+                {nextCursor && (
+                  <button
+                    onClick={fetchOlder}
+                    disabled={loadingOlder}
+                    className="text-green-400 hover:text-green-300 underline"
+                  >
+                    {loadingOlder ? "[Loading...]" : "[Load older]"}
+                  </button>
+                )}
               </div>
             )}
             
@@ -1,22 +1,27 @@
 import { NextRequest, NextResponse } from 'next/server'
-import { MongoClient } from 'mongodb'
+
+// 轉送給 chall 的分頁參數 (limit / before / since)
+const PAGE_PARAMS = ['limit', 'before', 'since']
 
 export async function GET(
     request: NextRequest,
     { params }: { params: Promise<{ team: string; chall: string }> }
 ) {
     try {
-        const mongodb_url = process.env.MONGODB
-        if (!mongodb_url) {
-            console.error('MONGODB 環境變數未設置')
+        const { team, chall } = await params
+
+        // 每個挑戰各自一個 chall 程序時以 CHALL_URL_<挑戰> 指定，否則共用 CHALL_URL
+        const chall_url =
+            process.env[`CHALL_URL_${chall.toUpperCase()}`] || process.env.CHALL_URL
+        const history_token = process.env.HISTORY_TOKEN
+        if (!chall_url || !history_token) {
+            console.error(`CHALL_URL (或 CHALL_URL_${chall.toUpperCase()}) 或 HISTORY_TOKEN 環境變數未設置`)
             return NextResponse.json(
                 { error: '服務器配置錯誤' },
                 { status: 500 }
             )
         }
 
-        const { team, chall } = await params
-
         // 驗證參數
         const teamId = parseInt(team)
         if (isNaN(teamId) || teamId < 1 || teamId > 10) {
@@ -26,24 +31,31 @@ export async function GET(
             )
         }
 
-        // 連接 MongoDB
-        const client = new MongoClient(mongodb_url, {
-            tlsAllowInvalidCertificates: true
-        })
-        await client.connect()
-
-        const db = client.db('sitcon_camp')
-        const collection = db.collection(chall) // 使用 chall 參數作為集合名稱
-
-        // 查詢該團隊的所有記錄，按時間排序
-        const records = await collection
-            .find({ team_id: teamId })
-            .sort({ timestamp: -1 }) // 最新的在前面
-            .toArray()
+        // 由 chall 的分頁 API 查詢 (使用 team_id + timestamp 索引，每次最多一頁)
+        const url = new URL(
+            `/chall/${encodeURIComponent(chall)}/history/${teamId}`,
+            chall_url
+        )
+        for (const name of PAGE_PARAMS) {
+            const value = request.nextUrl.searchParams.get(name)
+            if (value) {
+                url.searchParams.set(name, value)
+            }
+        }
 
-        await client.close()
+        const response = await fetch(url, {
+            headers: { 'X-History-Token': history_token },
+            cache: 'no-store'
+        })
+        if (!response.ok) {
+            console.error(`chall 回應 ${response.status}: ${await response.text()}`)
+            return NextResponse.json(
+                { error: '查詢失敗' },
+                { status: response.status === 400 || response.status === 404 ? response.status : 502 }
+            )
+        }
 
-        return NextResponse.json(records)
+        return NextResponse.json(await response.json())
 
     } catch (error) {
         console.error('API 錯誤:', error)
@@ -52,4 +64,4 @@ export async function GET(
             { status: 500 }
         )
     }
-} 
\ No newline at end of file
+}
@@ -1,32 +1,81 @@
 from fastapi import FastAPI, Request, Form, HTTPException, Depends
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import (
+    HTMLResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 import sqlite3
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import httpx
 import asyncio
 import logging
 from datetime import datetime, timezone
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 import secrets
-from functools import lru_cache
+import hashlib
+import hmac
+import re
+import sys
+import unicodedata
 from dotenv import load_dotenv
 import json
 
+# 與 chall 共用的模組放在專案根目錄的 common/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.assets import REVALIDATE, PageCache, StaticAssets
+from common.flags import verify_flag
+from common.log import setup_logging
+from common.metrics import (
+    CONTENT_TYPE,
+    Counter,
+    Histogram,
+    MetricsMiddleware,
+    TimedTemplates,
+)
+from common.metrics import render as render_metrics
+
 # 載入 .env 文件
 load_dotenv()
 
-# 配置日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler("ctf.log"), logging.StreamHandler()],
+# 配置日誌：JSON 記錄經由佇列在背景執行緒寫入，檔案依大小輪替
+setup_logging(
+    "panel",
+    log_file=os.getenv("LOG_FILE", "ctf.log"),
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", "5")),
 )
 logger = logging.getLogger(__name__)
 
+# 運作指標
+SQLITE_QUERY_SECONDS = Histogram(
+    "panel_sqlite_query_seconds",
+    "SQLite operation time in the database threads",
+    ["operation"],
+)
+LEADERBOARD_CACHE = Counter(
+    "panel_leaderboard_cache_total", "Leaderboard snapshot lookups", ["result"]
+)
+FLAG_SUBMISSIONS = Counter(
+    "panel_flag_submissions_total", "Flag submissions by result", ["result"]
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "panel_rate_limit_rejections_total", "Flag submissions rejected by rate limit"
+)
+WEBHOOK_FAILURES = Counter(
+    "panel_webhook_failures_total", "Failed Discord webhook attempts", ["reason"]
+)
+WEBHOOK_DROPPED = Counter(
+    "panel_webhook_dropped_total", "Discord notifications dropped"
+)
+
 
 # 配置類
 class Config:
@@ -35,11 +84,21 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY")
     ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
     WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL", "")
+    # 設定後改為驗證各隊專屬的 flag (需與 chall 相同)
+    FLAG_SECRET = os.getenv("FLAG_SECRET", "")
 
     # 系統限制
     MAX_TEAMS = int(os.getenv("MAX_TEAMS", "9"))
     MAX_LEVELS = int(os.getenv("MAX_LEVELS", "3"))
     RATE_LIMIT_ATTEMPTS = int(os.getenv("RATE_LIMIT_ATTEMPTS", "5"))
+    RATE_LIMIT_WINDOW = float(os.getenv("RATE_LIMIT_WINDOW", "60"))
+    # memory: 單一 worker 的記憶體限制；sqlite: 多個 worker 共用數據庫中的狀態
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    RATE_LIMIT_SNAPSHOT_INTERVAL = float(
+        os.getenv("RATE_LIMIT_SNAPSHOT_INTERVAL", "30")
+    )
+    # 檢查其他 worker 寫入並推送排行榜的間隔 (秒)，0 表示只推送本程序的寫入
+    LEADERBOARD_POLL_INTERVAL = float(os.getenv("LEADERBOARD_POLL_INTERVAL", "2"))
 
     @classmethod
     def validate_config(cls):
@@ -93,6 +152,16 @@ def validate_flag(flag: str) -> str:
 class DatabaseManager:
     def __init__(self, db_path: str):
         self.db_path = db_path
+        # 每個執行緒保留一個持久連接，避免每次查詢重新建立連接
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # 排行榜快照：寫入時遞增版本號，版本不符時重新查詢
+        self._leaderboard_version = 0
+        self._leaderboard_cache = None
+        # 專門讀取 PRAGMA data_version 的連接，其他連接 (含其他 worker) 提交時會改變
+        self._version_conn = None
+        self._version_lock = threading.Lock()
         self.init_db()
 
     def init_db(self):
@@ -127,17 +196,6 @@ class DatabaseManager:
                 """
                 )
 
-                # 創建速率限制表
-                c.execute(
-                    """
-                    CREATE TABLE rate_limits (
-                        team_level TEXT PRIMARY KEY,
-                        attempts INTEGER DEFAULT 0,
-                        last_attempt DATETIME DEFAULT CURRENT_TIMESTAMP
-                    )
-                """
-                )
-
                 # 初始化團隊數據
                 for team in range(1, Config.MAX_TEAMS + 1):
                     c.execute(
@@ -147,16 +205,113 @@ class DatabaseManager:
                 conn.commit()
                 conn.close()
                 logger.info("Database initialized successfully")
+
+            self.migrate()
         except Exception as e:
             logger.error(f"Database initialization failed: {e}")
             raise
 
-    def get_connection(self):
-        """獲取數據庫連接"""
+    def migrate(self):
+        """建立新版本新增的資料表（舊數據庫也適用）"""
         conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        try:
+            c = conn.cursor()
+
+            # 速率限制 token bucket 狀態
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    team_level TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """
+            )
+
+            # 各團隊提交統計摘要，於記錄提交時同步更新
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS team_stats (
+                    team INTEGER PRIMARY KEY,
+                    total_attempts INTEGER NOT NULL DEFAULT 0,
+                    correct_attempts INTEGER NOT NULL DEFAULT 0
+                )
+            """
+            )
+            c.execute(
+                "CREATE INDEX IF NOT EXISTS idx_submissions_team_level "
+                "ON submissions (team, level)"
+            )
+            c.execute(
+                "CREATE INDEX IF NOT EXISTS idx_progress_level "
+                "ON progress (level DESC, last_updated)"
+            )
+
+            # 舊數據庫首次升級時由既有提交記錄回填摘要
+            if c.execute("SELECT COUNT(*) FROM team_stats").fetchone()[0] == 0:
+                c.execute(
+                    """
+                    INSERT INTO team_stats (team, total_attempts, correct_attempts)
+                    SELECT
+                        team,
+                        COUNT(*),
+                        SUM(CASE WHEN is_correct = 1 THEN 1 ELSE 0 END)
+                    FROM submissions
+                    GROUP BY team
+                """
+                )
+
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_connection(self):
+        """獲取當前執行緒的持久數據庫連接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 持久連接可重用 sqlite3 內建的 prepared statement 快取
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=5.0,
+                cached_statements=256,
+                # 關閉時可能由其他執行緒呼叫 close()
+                check_same_thread=False,
+            )
+            conn.row_factory = sqlite3.Row
+            # WAL 模式下讀取不會阻塞寫入；NORMAL 在 WAL 下仍可保證一致性
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
         return conn
 
+    def close(self):
+        """關閉所有持久連接"""
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception as e:
+                    logger.error(f"Failed to close database connection: {e}")
+            self._connections.clear()
+        self._local = threading.local()
+        with self._version_lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
+
+    def data_version(self) -> int:
+        """資料庫的變動版本，任何其他連接提交寫入後都會不同"""
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = sqlite3.connect(
+                    self.db_path, timeout=5.0, check_same_thread=False
+                )
+            # data_version 只在同一連接上比較才有意義，因此固定使用這個連接
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
     def get_team_level(self, team: int) -> int:
         """獲取團隊當前等級"""
         try:
@@ -179,6 +334,7 @@ class DatabaseManager:
                     (level, team),
                 )
                 conn.commit()
+                self._leaderboard_version += 1
                 return c.rowcount > 0
         except Exception as e:
             logger.error(f"Failed to update team level for team {team}: {e}")
@@ -196,83 +352,351 @@ class DatabaseManager:
                 """,
                     (team, level, flag, is_correct),
                 )
+                c.execute(
+                    """
+                    INSERT INTO team_stats (team, total_attempts, correct_attempts)
+                    VALUES (?, 1, ?)
+                    ON CONFLICT(team) DO UPDATE SET
+                        total_attempts = total_attempts + 1,
+                        correct_attempts = correct_attempts + excluded.correct_attempts
+                """,
+                    (team, int(is_correct)),
+                )
                 conn.commit()
+                self._leaderboard_version += 1
         except Exception as e:
             logger.error(f"Failed to record submission: {e}")
 
-    def check_rate_limit(self, team: int, level: int) -> bool:
-        """檢查速率限制"""
-        try:
-            key = f"{team}_{level}"
-            now = datetime.now(timezone.utc)
+    def load_rate_limit_buckets(self) -> List[Tuple[str, float, float]]:
+        """讀取速率限制快照"""
+        with self.get_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT team_level, tokens, updated_at FROM rate_limit_buckets")
+            return [tuple(row) for row in c.fetchall()]
 
+    def save_rate_limit_buckets(self, buckets: List[Tuple[str, float, float]]):
+        """寫入速率限制快照"""
+        try:
             with self.get_connection() as conn:
-                c = conn.cursor()
-                c.execute(
+                conn.executemany(
                     """
-                    SELECT attempts, last_attempt FROM rate_limits WHERE team_level = ?
+                    INSERT INTO rate_limit_buckets (team_level, tokens, updated_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(team_level) DO UPDATE SET
+                        tokens = excluded.tokens, updated_at = excluded.updated_at
                 """,
-                    (key,),
-                )
-                row = c.fetchone()
-
-                if not row:
-                    c.execute(
-                        """
-                        INSERT INTO rate_limits (team_level, attempts, last_attempt)
-                        VALUES (?, 1, ?)
-                    """,
-                        (key, now),
-                    )
-                    conn.commit()
-                    return True
-
-                last_attempt = datetime.fromisoformat(
-                    row["last_attempt"].replace("Z", "+00:00")
+                    buckets,
                 )
-                attempts = row["attempts"]
-
-                if (now - last_attempt).total_seconds() > 60:
-                    c.execute(
-                        """
-                        UPDATE rate_limits SET attempts = 1, last_attempt = ?
-                        WHERE team_level = ?
-                    """,
-                        (now, key),
-                    )
-                    conn.commit()
-                    return True
-
-                if attempts >= Config.RATE_LIMIT_ATTEMPTS:
-                    return False
+        except Exception as e:
+            logger.error(f"Failed to save rate limit snapshot: {e}")
 
-                c.execute(
+    def consume_rate_limit_token(
+        self, key: str, capacity: float, refill_rate: float
+    ) -> bool:
+        """在單一交易中原子地扣除 token，多個 worker 共用同一份狀態"""
+        try:
+            conn = self.get_connection()
+            now = time.time()
+            with conn:
+                # IMMEDIATE 取得寫入鎖，避免並行請求同時讀到相同的 token 數
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT tokens, updated_at FROM rate_limit_buckets WHERE team_level = ?",
+                    (key,),
+                ).fetchone()
+                tokens, allowed = refill_bucket(row, now, capacity, refill_rate)
+                conn.execute(
                     """
-                    UPDATE rate_limits SET attempts = attempts + 1, last_attempt = ?
-                    WHERE team_level = ?
+                    INSERT INTO rate_limit_buckets (team_level, tokens, updated_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(team_level) DO UPDATE SET
+                        tokens = excluded.tokens, updated_at = excluded.updated_at
                 """,
-                    (now, key),
+                    (key, tokens, now),
                 )
-                conn.commit()
-                return True
-
+            return allowed
         except Exception as e:
             logger.error(f"Rate limit check failed: {e}")
             return True
 
+    def get_leaderboard(self):
+        """獲取排行榜與各團隊提交統計，數據未變動時回傳快照"""
+        # 本程序的寫入與其他 worker 的寫入都會讓版本改變
+        version = (self._leaderboard_version, self.data_version())
+        cached = self._leaderboard_cache
+        if cached is not None and cached[0] == version:
+            LEADERBOARD_CACHE.inc(result="hit")
+            return cached[1]
+        LEADERBOARD_CACHE.inc(result="miss")
+
+        with self.get_connection() as conn:
+            c = conn.cursor()
+            c.execute(
+                """
+                SELECT team, level, last_updated
+                FROM progress
+                WHERE level > 0
+                ORDER BY level DESC, last_updated ASC
+            """
+            )
+            teams = [dict(row) for row in c.fetchall()]
+
+            # 獲取總提交統計
+            c.execute(
+                """
+                SELECT team, total_attempts, correct_attempts
+                FROM team_stats
+                ORDER BY team
+            """
+            )
+            stats = {
+                row["team"]: {
+                    "total_attempts": row["total_attempts"],
+                    "correct_attempts": row["correct_attempts"],
+                }
+                for row in c.fetchall()
+            }
+
+        self._leaderboard_cache = (version, (teams, stats))
+        return teams, stats
+
+
+# 非同步數據庫存取類
+class AsyncDatabaseManager:
+    """在背景執行緒執行數據庫操作，避免阻塞事件迴圈"""
+
+    def __init__(self, db: DatabaseManager, read_workers: int = 4):
+        self.db = db
+        # 讀取可在多個執行緒並行 (WAL)，寫入集中在單一執行緒依序執行
+        self._reader = ThreadPoolExecutor(
+            max_workers=read_workers, thread_name_prefix="db-read"
+        )
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+
+    @staticmethod
+    def _timed(fn, *args):
+        # 只計算執行緒內的執行時間，不含排隊等待
+        with SQLITE_QUERY_SECONDS.time(operation=fn.__name__):
+            return fn(*args)
+
+    async def _read(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._reader, self._timed, fn, *args
+        )
+
+    async def _write(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._writer, self._timed, fn, *args
+        )
+
+    async def get_team_level(self, team: int) -> int:
+        return await self._read(self.db.get_team_level, team)
+
+    async def update_team_level(self, team: int, level: int) -> bool:
+        return await self._write(self.db.update_team_level, team, level)
+
+    async def record_submission(
+        self, team: int, level: int, flag: str, is_correct: bool
+    ):
+        return await self._write(
+            self.db.record_submission, team, level, flag, is_correct
+        )
+
+    async def consume_rate_limit_token(
+        self, key: str, capacity: float, refill_rate: float
+    ) -> bool:
+        return await self._write(
+            self.db.consume_rate_limit_token, key, capacity, refill_rate
+        )
+
+    async def load_rate_limit_buckets(self) -> List[Tuple[str, float, float]]:
+        return await self._read(self.db.load_rate_limit_buckets)
+
+    async def save_rate_limit_buckets(self, buckets: List[Tuple[str, float, float]]):
+        return await self._write(self.db.save_rate_limit_buckets, buckets)
+
+    async def get_leaderboard(self):
+        return await self._read(self.db.get_leaderboard)
+
+    async def data_version(self) -> int:
+        return await self._read(self.db.data_version)
+
+    def close(self):
+        """等待進行中的操作完成後關閉執行緒與連接"""
+        self._reader.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        self.db.close()
+
+
+def refill_bucket(
+    bucket: Optional[Tuple[float, float]],
+    now: float,
+    capacity: float,
+    refill_rate: float,
+) -> Tuple[float, bool]:
+    """依經過時間補充 token 並嘗試扣除一個，回傳 (剩餘 token, 是否允許)"""
+    if bucket is None:
+        tokens = capacity
+    else:
+        tokens, updated_at = bucket
+        tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+
+    if tokens < 1:
+        return tokens, False
+    return tokens - 1, True
+
+
+# 速率限制類
+class RateLimiter:
+    """記憶體內的 token bucket 速率限制，以 team/level 為 key"""
+
+    def __init__(self, capacity: int, window: float):
+        self.capacity = capacity
+        self.refill_rate = capacity / window
+        # "team_level" -> (tokens, updated_at)
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    async def check(self, team: int, level: int) -> bool:
+        """檢查並扣除一次提交額度"""
+        key = f"{team}_{level}"
+        now = time.time()
+        with self._lock:
+            tokens, allowed = refill_bucket(
+                self.buckets.get(key), now, self.capacity, self.refill_rate
+            )
+            self.buckets[key] = (tokens, now)
+        return allowed
+
+    def snapshot(self) -> List[Tuple[str, float, float]]:
+        with self._lock:
+            return [
+                (key, tokens, updated_at)
+                for key, (tokens, updated_at) in self.buckets.items()
+            ]
+
+    def restore(self, rows: List[Tuple[str, float, float]]):
+        with self._lock:
+            for key, tokens, updated_at in rows:
+                self.buckets[key] = (tokens, updated_at)
+
+
+class SQLiteRateLimiter:
+    """狀態存放在 SQLite 的 token bucket 速率限制，多個 worker 可共用"""
+
+    def __init__(self, db: "AsyncDatabaseManager", capacity: int, window: float):
+        self.db = db
+        self.capacity = capacity
+        self.refill_rate = capacity / window
+
+    async def check(self, team: int, level: int) -> bool:
+        """檢查並扣除一次提交額度"""
+        return await self.db.consume_rate_limit_token(
+            f"{team}_{level}", self.capacity, self.refill_rate
+        )
+
 
 # 挑戰管理類
+def normalize_flag(flag: str) -> str:
+    """正規化 flag：去除前後空白並統一 Unicode 表示"""
+    return unicodedata.normalize("NFC", flag.strip())
+
+
+class FlagVerifier:
+    """單一關卡的 flag 驗證器，只保存加鹽雜湊與格式規則"""
+
+    def __init__(self, salt: bytes, spec: Any):
+        self.salt = salt
+        self.digests: List[bytes] = []
+        self.patterns: List[re.Pattern] = []
+        self.prefixes: List[bytes] = []
+
+        # 支援字串、字串列表，或 {"regex": ...} / {"prefix": ...} 格式
+        for item in spec if isinstance(spec, list) else [spec]:
+            if isinstance(item, str):
+                self.digests.append(self.digest(item))
+            elif isinstance(item, dict) and "regex" in item:
+                self.patterns.append(re.compile(item["regex"]))
+            elif isinstance(item, dict) and "prefix" in item:
+                self.prefixes.append(normalize_flag(item["prefix"]).encode("utf-8"))
+            else:
+                raise ValueError(f"Unsupported flag format: {item!r}")
+
+    def digest(self, flag: str) -> bytes:
+        return hmac.new(
+            self.salt, normalize_flag(flag).encode("utf-8"), hashlib.sha256
+        ).digest()
+
+    def verify(self, flag: str) -> bool:
+        digest = self.digest(flag)
+
+        # 與所有雜湊逐一比較，耗時不因命中位置而不同
+        matched = False
+        for expected in self.digests:
+            matched |= hmac.compare_digest(expected, digest)
+        if matched:
+            return True
+
+        normalized = normalize_flag(flag)
+        if any(pattern.fullmatch(normalized) for pattern in self.patterns):
+            return True
+        encoded = normalized.encode("utf-8")
+        return any(encoded.startswith(prefix) for prefix in self.prefixes)
+
+
 class ChallengeManager:
-    def __init__(self):
-        # 從 data.json 載入 flags 與 challenge_info，並將 key 轉為 int
-        with open("data.json", "r", encoding="utf-8") as f:
+    def __init__(
+        self,
+        data_path: str = "data.json",
+        check_interval: float = 2.0,
+        flag_secret: str = "",
+    ):
+        self.data_path = data_path
+        self.check_interval = check_interval
+        self.flag_secret = flag_secret
+        # 每次啟動隨機產生的鹽，明文 flag 不會保存在記憶體中
+        self.salt = secrets.token_bytes(32)
+        self.verifiers: Dict[int, FlagVerifier] = {}
+        self.challenge_info: Dict[int, Dict[str, Any]] = {}
+        self.signature = None
+        self.checked_at = 0.0
+        self.load()
+
+    def load(self):
+        """從 data.json 載入 flags 與 challenge_info，並將 key 轉為 int"""
+        st = os.stat(self.data_path)
+        with open(self.data_path, "r", encoding="utf-8") as f:
             data = json.load(f)
-        self.flags = {int(k): v for k, v in data["flags"].items()}
-        self.challenge_info = {int(k): v for k, v in data["challenge_info"].items()}
 
-    @lru_cache(maxsize=128)
+        verifiers = {
+            int(k): FlagVerifier(self.salt, v) for k, v in data["flags"].items()
+        }
+        challenge_info = {int(k): v for k, v in data["challenge_info"].items()}
+
+        # 建立完成後一次替換，請求不會看到載入到一半的數據
+        self.verifiers = verifiers
+        self.challenge_info = challenge_info
+        self.signature = (st.st_mtime_ns, st.st_size)
+        self.checked_at = time.monotonic()
+
+    def reload_if_changed(self):
+        """data.json 修改後重新載入，載入失敗時沿用舊數據"""
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+
+        try:
+            st = os.stat(self.data_path)
+            if (st.st_mtime_ns, st.st_size) != self.signature:
+                self.load()
+                logger.info("Reloaded challenge data from data.json")
+        except Exception as e:
+            logger.error(f"Failed to reload data.json: {e}")
+
     def get_challenge_info(self, level: int) -> Dict[str, Any]:
         """獲取挑戰信息"""
+        self.reload_if_changed()
         return self.challenge_info.get(
             level,
             {
@@ -283,60 +707,238 @@ class ChallengeManager:
             },
         )
 
-    def validate_flag(self, level: int, flag: str) -> bool:
+    def validate_flag(self, level: int, flag: str, team: Optional[int] = None) -> bool:
         """驗證 flag"""
-        if level not in self.flags:
-            return False
+        if self.flag_secret and team is not None:
+            # 隊伍專屬 flag 以重新計算 HMAC 驗證，不需查表
+            return verify_flag(self.flag_secret, team, level, normalize_flag(flag))
 
-        expected_flag = self.flags[level]
-        submitted_flag = flag.strip()
+        self.reload_if_changed()
+        verifier = self.verifiers.get(level)
+        if verifier is None:
+            return False
 
-        return secrets.compare_digest(expected_flag, submitted_flag)
+        return verifier.verify(flag)
+
+
+# 排行榜推送類
+def leaderboard_state(teams, stats) -> Dict[str, Any]:
+    """將排行榜查詢結果整理為可序列化的狀態"""
+    state: Dict[str, Dict[str, Any]] = {}
+    for team in teams:
+        state[str(team["team"])] = {
+            "level": team["level"],
+            "last_updated": team["last_updated"],
+        }
+    for team, stat in stats.items():
+        state.setdefault(str(team), {"level": 0, "last_updated": None}).update(stat)
+
+    return {"order": [team["team"] for team in teams], "teams": state}
+
+
+class LeaderboardBroadcaster:
+    """將排行榜變動推送給所有 SSE 連線"""
+
+    def __init__(self, max_pending: int = 16):
+        self.max_pending = max_pending
+        self.subscribers = set()
+        self.state: Optional[Dict[str, Any]] = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.max_pending)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, state: Dict[str, Any]):
+        """與上次推送的狀態比較，只廣播有變動的團隊"""
+        previous = self.state or {"order": [], "teams": {}}
+        self.state = state
+
+        changed = {
+            team: data
+            for team, data in state["teams"].items()
+            if previous["teams"].get(team) != data
+        }
+        if not changed and state["order"] == previous["order"]:
+            return
+
+        diff = {"order": state["order"], "teams": changed}
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(diff)
+            except asyncio.QueueFull:
+                # 跟不上的連線改送結束標記，讓瀏覽器重新連線取得完整快照
+                self.unsubscribe(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
 
 
 # Discord 通知管理類
 class NotificationManager:
-    def __init__(self, webhook_url: str):
+    """以單一背景任務批次發送 Discord 通知，並遵守速率限制"""
+
+    # Discord 單一訊息最多 10 個 embed
+    MAX_EMBEDS = 10
+
+    def __init__(
+        self,
+        webhook_url: str,
+        max_queue: int = 500,
+        batch_delay: float = 1.0,
+        max_retries: int = 3,
+    ):
         self.webhook_url = webhook_url
         self.client = httpx.AsyncClient(timeout=10.0)
-
-    async def send_submission_notification(
+        self.max_queue = max_queue
+        self.batch_delay = batch_delay
+        self.max_retries = max_retries
+        # (is_correct, embed)
+        self.pending: deque = deque()
+        self.wakeup = asyncio.Event()
+        self.worker: Optional[asyncio.Task] = None
+        self.closing = False
+        self.dropped = 0
+
+    def build_embed(
+        self, team: int, level: int, flag: str, is_correct: bool
+    ) -> Dict[str, Any]:
+        """建立提交通知的 embed"""
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+        status_text = "✅ 正確" if is_correct else "❌ 錯誤"
+
+        return {
+            "title": "Flag 提交記錄",
+            "color": 0x00FF00 if is_correct else 0xFF0000,
+            "fields": [
+                {"name": "小隊", "value": str(team), "inline": True},
+                {"name": "關卡", "value": str(level), "inline": True},
+                {"name": "狀態", "value": status_text, "inline": True},
+                {"name": "提交時間", "value": now, "inline": False},
+                {"name": "Flag", "value": f"`{flag}`", "inline": False},
+            ],
+        }
+
+    def send_submission_notification(
         self, team: int, level: int, flag: str, is_correct: bool
     ):
-        """發送提交通知"""
-        try:
-            now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-            status_text = "✅ 正確" if is_correct else "❌ 錯誤"
-
-            embed = {
-                "title": "Flag 提交記錄",
-                "color": 0x00FF00 if is_correct else 0xFF0000,
-                "fields": [
-                    {"name": "小隊", "value": str(team), "inline": True},
-                    {"name": "關卡", "value": str(level), "inline": True},
-                    {"name": "狀態", "value": status_text, "inline": True},
-                    {"name": "提交時間", "value": now, "inline": False},
-                    {"name": "Flag", "value": f"`{flag}`", "inline": False},
-                ],
-            }
-
-            payload = {"embeds": [embed]}
-
-            response = await self.client.post(self.webhook_url, json=payload)
-            response.raise_for_status()
-
-        except Exception as e:
-            logger.error(f"Failed to send Discord notification: {e}")
-
-    async def close(self):
-        """關閉HTTP客戶端"""
+        """將提交通知放入佇列，由背景任務合併發送"""
+        if self.closing:
+            return
+
+        if len(self.pending) >= self.max_queue:
+            self.dropped += 1
+            WEBHOOK_DROPPED.inc()
+            logger.warning("Discord notification queue full, dropping one")
+            # 佇列已滿時優先丟棄錯誤提交的通知，保留解題通知
+            wrong = next(
+                (
+                    i
+                    for i, (queued_correct, _) in enumerate(self.pending)
+                    if not queued_correct
+                ),
+                None,
+            )
+            if wrong is not None:
+                del self.pending[wrong]
+            elif is_correct:
+                self.pending.popleft()
+            else:
+                return
+
+        self.pending.append(
+            (is_correct, self.build_embed(team, level, flag, is_correct))
+        )
+        self.wakeup.set()
+
+    def start(self):
+        """啟動背景發送任務"""
+        if self.worker is None:
+            self.worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self.wakeup.wait()
+            if not self.pending:
+                self.wakeup.clear()
+                if self.closing:
+                    return
+                continue
+
+            # 稍等片刻，讓短時間內的多筆提交合併成一則訊息
+            if not self.closing:
+                await asyncio.sleep(self.batch_delay)
+
+            batch = []
+            while self.pending and len(batch) < self.MAX_EMBEDS:
+                batch.append(self.pending.popleft()[1])
+            await self._send(batch)
+
+    async def _send(self, embeds: List[Dict[str, Any]]):
+        """發送一則包含多個 embed 的訊息，429 時依 Retry-After 等待後重試"""
+        for attempt in range(self.max_retries + 1):
+            # 最後一次失敗後直接放棄，不讓後面的通知多等
+            last_attempt = attempt == self.max_retries
+            try:
+                response = await self.client.post(
+                    self.webhook_url, json={"embeds": embeds}
+                )
+                if response.status_code == 429:
+                    retry_after = float(
+                        response.headers.get("Retry-After")
+                        or response.json().get("retry_after", 1)
+                    )
+                    WEBHOOK_FAILURES.inc(reason="rate_limited")
+                    if last_attempt:
+                        break
+                    logger.warning(
+                        f"Discord rate limited, retrying in {retry_after:.1f}s"
+                    )
+                    await asyncio.sleep(retry_after)
+                    continue
+
+                response.raise_for_status()
+                return
+            except Exception as e:
+                WEBHOOK_FAILURES.inc(reason="error")
+                logger.error(f"Failed to send Discord notification: {e}")
+                if not last_attempt:
+                    await asyncio.sleep(min(2**attempt, 10))
+
+        self.dropped += len(embeds)
+        WEBHOOK_DROPPED.inc(len(embeds))
+        logger.error(f"Dropped {len(embeds)} Discord notifications after retries")
+
+    async def close(self, timeout: float = 10.0):
+        """送出佇列中剩餘的通知後關閉HTTP客戶端"""
+        self.closing = True
+        self.wakeup.set()
+        if self.worker is not None:
+            try:
+                await asyncio.wait_for(self.worker, timeout)
+            except asyncio.TimeoutError:
+                logger.error(
+                    f"Timed out flushing Discord notifications, "
+                    f"{len(self.pending)} not sent"
+                )
         await self.client.aclose()
 
 
 # 全局實例
 Config.validate_config()
 db_manager = DatabaseManager(Config.DB_PATH)
-challenge_manager = ChallengeManager()
+db = AsyncDatabaseManager(db_manager)
+if Config.RATE_LIMIT_BACKEND == "sqlite":
+    rate_limiter = SQLiteRateLimiter(
+        db, Config.RATE_LIMIT_ATTEMPTS, Config.RATE_LIMIT_WINDOW
+    )
+else:
+    rate_limiter = RateLimiter(Config.RATE_LIMIT_ATTEMPTS, Config.RATE_LIMIT_WINDOW)
+challenge_manager = ChallengeManager(flag_secret=Config.FLAG_SECRET)
+leaderboard_broadcaster = LeaderboardBroadcaster()
 notification_manager = (
     NotificationManager(Config.WEBHOOK_URL) if Config.WEBHOOK_URL else None
 )
@@ -356,6 +958,8 @@ app.add_middleware(
     https_only=False,  # 在生產環境中設為 True
 )
 
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -364,25 +968,78 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 靜態文件
-if os.path.exists("static"):
-    app.mount("/static", StaticFiles(directory="static"), name="static")
-
 # 模板
-templates = Jinja2Templates(directory="templates")
+templates = TimedTemplates(directory="templates")
+# 不含使用者輸入的頁面渲染一次後重複使用
+pages = PageCache(templates)
+
+# 靜態文件：於 startup 時預先壓縮，模板以 static_url() 取得含內容雜湊的網址
+static_assets = StaticAssets("static") if os.path.exists("static") else None
+if static_assets is not None:
+    templates.env.globals["static_url"] = static_assets.url
+
+    @app.api_route(
+        "/static/{path:path}", methods=["GET", "HEAD"], include_in_schema=False
+    )
+    async def static_file(request: Request, path: str):
+        return static_assets.response(request, path)
+
+
+# 背景任務
+background_tasks = set()
+
+
+async def snapshot_rate_limits():
+    """定期將記憶體內的速率限制狀態寫入 SQLite，重啟後可恢復"""
+    while True:
+        await asyncio.sleep(Config.RATE_LIMIT_SNAPSHOT_INTERVAL)
+        await db.save_rate_limit_buckets(rate_limiter.snapshot())
+
+
+async def watch_leaderboard():
+    """定期檢查數據庫版本，其他 worker 處理的提交也推送給本程序的 SSE 連線"""
+    version = None
+    while True:
+        await asyncio.sleep(Config.LEADERBOARD_POLL_INTERVAL)
+        if not leaderboard_broadcaster.subscribers:
+            continue
+        try:
+            current = await db.data_version()
+        except Exception as e:
+            logger.error(f"Failed to check database version: {e}")
+            continue
+        if current != version:
+            version = current
+            await publish_leaderboard()
 
 
 # 啟動和關閉事件
 @app.on_event("startup")
 async def startup_event():
     logger.info("CTF Server starting up...")
+    if static_assets is not None:
+        static_assets.load()
+    if notification_manager:
+        notification_manager.start()
+    if isinstance(rate_limiter, RateLimiter):
+        rate_limiter.restore(await db.load_rate_limit_buckets())
+        if Config.RATE_LIMIT_SNAPSHOT_INTERVAL > 0:
+            task = asyncio.create_task(snapshot_rate_limits())
+            background_tasks.add(task)
+    if Config.LEADERBOARD_POLL_INTERVAL > 0:
+        background_tasks.add(asyncio.create_task(watch_leaderboard()))
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("CTF Server shutting down...")
+    for task in background_tasks:
+        task.cancel()
+    if isinstance(rate_limiter, RateLimiter):
+        await db.save_rate_limit_buckets(rate_limiter.snapshot())
     if notification_manager:
         await notification_manager.close()
+    db.close()
 
 
 # 依賴項
@@ -414,7 +1071,7 @@ def require_admin(request: Request) -> bool:
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     """首頁"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return pages.get("index", "index.html", {}).response(request, REVALIDATE)
 
 
 @app.post("/set_team")
@@ -423,7 +1080,7 @@ async def set_team(request: Request, team: int = Form(...)):
     try:
         validated_team = validate_team(team)
         request.session["team"] = validated_team
-        logger.info(f"Team {team} logged in")
+        logger.info(f"Team {team} logged in", extra={"team": team})
         return RedirectResponse("/challenge/1", status_code=303)
     except ValueError as e:
         logger.warning(f"Invalid team selection: {e}")
@@ -436,23 +1093,20 @@ async def challenge(request: Request, level: int, team: int = Depends(require_te
     if not 1 <= level <= Config.MAX_LEVELS:
         raise HTTPException(status_code=404, detail="挑戰不存在")
 
-    current_level = db_manager.get_team_level(team)
+    current_level = await db.get_team_level(team)
 
     if level > current_level + 1:
         raise HTTPException(status_code=403, detail="您尚未解鎖此挑戰")
 
     info = challenge_manager.get_challenge_info(level)
 
-    return templates.TemplateResponse(
+    # 頁面內容只取決於關卡與 data.json，data.json 重新載入後 signature 會改變
+    page = pages.get(
+        ("challenge", level, challenge_manager.signature),
         "challenge.html",
-        {
-            "request": request,
-            "level": level,
-            "info": info,
-            "team": team,
-            "current_level": current_level,
-        },
+        {"level": level, "info": info},
     )
+    return page.response(request, f"private, {REVALIDATE}")
 
 
 @app.post("/submit/{level}", response_class=HTMLResponse)
@@ -472,33 +1126,42 @@ async def submit_flag(
             raise HTTPException(status_code=404, detail="挑戰不存在")
 
         # 檢查權限
-        current_level = db_manager.get_team_level(team)
+        current_level = await db.get_team_level(team)
         if level > current_level + 1:
             raise HTTPException(status_code=403, detail="您尚未解鎖此挑戰")
 
         # 檢查速率限制
-        if not db_manager.check_rate_limit(team, level):
-            logger.warning(f"Rate limit exceeded for team {team}, level {level}")
+        if not await rate_limiter.check(team, level):
+            logger.warning(
+                f"Rate limit exceeded for team {team}, level {level}",
+                extra={"team": team, "challenge": level},
+            )
+            RATE_LIMIT_REJECTIONS.inc()
             raise HTTPException(status_code=429, detail="提交太頻繁，請稍後再試")
 
         # 驗證 flag
-        is_correct = challenge_manager.validate_flag(level, validated_flag)
+        is_correct = challenge_manager.validate_flag(level, validated_flag, team)
+        FLAG_SUBMISSIONS.inc(result="correct" if is_correct else "wrong")
 
         # 記錄提交
-        db_manager.record_submission(team, level, validated_flag, is_correct)
+        await db.record_submission(team, level, validated_flag, is_correct)
 
         # 發送通知（異步，如果有配置 Webhook）
         if notification_manager:
-            asyncio.create_task(
-                notification_manager.send_submission_notification(
-                    team, level, validated_flag, is_correct
-                )
+            notification_manager.send_submission_notification(
+                team, level, validated_flag, is_correct
             )
 
         if is_correct:
             # 更新進度
-            db_manager.update_team_level(team, level)
-            logger.info(f"Team {team} completed level {level}")
+            await db.update_team_level(team, level)
+            logger.info(
+                f"Team {team} completed level {level}",
+                extra={"team": team, "challenge": level},
+            )
+
+            # 推送排行榜變動
+            await publish_leaderboard()
 
             # 檢查是否完成所有挑戰
             if level == Config.MAX_LEVELS:
@@ -523,6 +1186,8 @@ async def submit_flag(
             },
         )
 
+    except HTTPException:
+        raise
     except ValueError as e:
         # 輸入驗證錯誤
         info = challenge_manager.get_challenge_info(level)
@@ -533,7 +1198,7 @@ async def submit_flag(
                 "level": level,
                 "info": info,
                 "team": team,
-                "current_level": db_manager.get_team_level(team),
+                "current_level": await db.get_team_level(team),
                 "error": f"輸入錯誤：{e}",
             },
         )
@@ -548,7 +1213,9 @@ async def admin_login(request: Request):
     if check_admin_auth(request):
         return RedirectResponse("/leaderboard", status_code=303)
 
-    return templates.TemplateResponse("admin_login.html", {"request": request})
+    return pages.get("admin_login", "admin_login.html", {}).response(
+        request, REVALIDATE
+    )
 
 
 @app.post("/admin/login")
@@ -576,37 +1243,7 @@ async def admin_logout(request: Request):
 async def leaderboard(request: Request, _: bool = Depends(require_admin)):
     """排行榜（僅管理員可見）"""
     try:
-        with db_manager.get_connection() as conn:
-            c = conn.cursor()
-            c.execute(
-                """
-                SELECT team, level, last_updated
-                FROM progress
-                WHERE level > 0
-                ORDER BY level DESC, last_updated ASC
-            """
-            )
-            teams = c.fetchall()
-
-            # 獲取總提交統計
-            c.execute(
-                """
-                SELECT
-                    team,
-                    COUNT(*) as total_attempts,
-                    SUM(CASE WHEN is_correct = 1 THEN 1 ELSE 0 END) as correct_attempts
-                FROM submissions
-                GROUP BY team
-                ORDER BY team
-            """
-            )
-            stats = {
-                row["team"]: {
-                    "total_attempts": row["total_attempts"],
-                    "correct_attempts": row["correct_attempts"],
-                }
-                for row in c.fetchall()
-            }
+        teams, stats = await db.get_leaderboard()
 
         return templates.TemplateResponse(
             "leaderboard.html", {"request": request, "teams": teams, "stats": stats}
@@ -616,6 +1253,56 @@ async def leaderboard(request: Request, _: bool = Depends(require_admin)):
         raise HTTPException(status_code=500, detail="無法載入排行榜")
 
 
+async def publish_leaderboard():
+    """查詢一次最新排行榜並廣播給所有連線"""
+    try:
+        teams, stats = await db.get_leaderboard()
+        leaderboard_broadcaster.publish(leaderboard_state(teams, stats))
+    except Exception as e:
+        logger.error(f"Failed to publish leaderboard: {e}")
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/leaderboard/stream")
+async def leaderboard_stream(request: Request, _: bool = Depends(require_admin)):
+    """排行榜即時推送 (SSE，僅管理員可見)"""
+    queue = leaderboard_broadcaster.subscribe()
+
+    async def event_stream():
+        try:
+            # 連線時先送出完整快照，之後只送出變動
+            teams, stats = await db.get_leaderboard()
+            yield sse_event("snapshot", leaderboard_state(teams, stats))
+
+            while not await request.is_disconnected():
+                try:
+                    diff = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # 保持連線
+                    yield ": keepalive\n\n"
+                    continue
+                if diff is None:
+                    break
+                yield sse_event("diff", diff)
+        finally:
+            leaderboard_broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 格式的運作指標"""
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
+
+
 # 錯誤處理
 @app.exception_handler(404)
 async def not_found_handler(request: Request, exc):